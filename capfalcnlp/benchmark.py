@@ -0,0 +1,258 @@
+'''Benchmark of the detection pipeline on a synthetic French corpus.
+
+    $ python -m capfalcnlp.benchmark --n-documents 200 --output-file report.json
+    $ python -m capfalcnlp.benchmark --n-documents 200 --baseline-file report.json  # Exits with 1 on regressions
+
+With `--offline`, nothing is downloaded: the rank indexes are built from the synthetic corpus vocabulary, the spaCy
+pipeline is a blank French pipeline (tokenizer only, no Lefff) and the sentence splitter an untrained punkt model, all
+saved in a temporary directory. The timings are then only comparable with other offline reports.
+'''
+import argparse
+import json
+from pathlib import Path
+import random
+import resource
+import sys
+import tempfile
+import time
+
+t0 = time.perf_counter()
+from capfalcnlp import features, processing  # noqa: E402
+from capfalcnlp.features import get_detections, get_detections_batch, WORD_VERDICT_CACHE  # noqa: E402
+from capfalcnlp.processing import (  # noqa: E402
+    CompactToken,
+    configure_lemmatization,
+    configure_spacy_doc_cache,
+    get_nltk_sentence_tokenizer,
+    get_punkt_snapshot_path,
+    get_spacy_model,
+    get_spacy_snapshot_path,
+    get_spacy_tokenizer,
+)
+from capfalcnlp.ranks import build_rank_index  # noqa: E402
+
+IMPORT_DURATION = time.perf_counter() - t0
+
+
+# fmt: off
+COMMON_WORDS = ['le', 'la', 'les', 'un', 'une', 'des', 'de', 'du', 'et', 'ou', 'mais', 'donc', 'car', 'il', 'elle', 'nous', 'vous', 'ils', 'est', 'sont', 'a', 'ont', 'fait', 'dit', 'peut', 'doit', 'va', 'dans', 'sur', 'avec', 'pour', 'par', 'sans', 'sous', 'entre', 'vers', 'chez', 'plus', 'moins', 'très', 'bien', 'aussi', 'encore', 'toujours', 'jamais', 'maison', 'ville', 'pays', 'travail', 'temps', 'jour', 'année', 'monde', 'vie', 'homme', 'femme', 'enfant', 'famille', 'école', 'question', 'problème', 'projet', 'service', 'aide', 'santé', 'droit', 'grand', 'petit', 'nouveau', 'bon', 'simple', 'important', 'public', 'social', 'premier', 'dernier']  # noqa
+RARE_WORDS = ['neurobiologie', 'computationnelle', 'algorithmique', 'épistémologie', 'paradigme', 'heuristique', 'ontologie', 'stochastique', 'herméneutique', 'idiosyncrasie']  # noqa
+ENGLISH_WORDS = ['meeting', 'deadline', 'feedback', 'smartphone', 'afterwork', 'jetlag', 'workflow', 'startup']
+SPECIAL_WORDS = ['CNIL', 'IA', 'SNCF', 'ONU', 'bcp', 'svp', 'etc.', 'c.-à-d.', 'et al.', '12', '3,5', '2021', 'PARIS', 'URGENT']  # noqa
+# fmt: on
+
+
+def generate_sentence(rng):
+    n_words = rng.randint(4, 30)
+    words = []
+    for _ in range(n_words):
+        draw = rng.random()
+        if draw < 0.8:
+            words.append(rng.choice(COMMON_WORDS))
+        elif draw < 0.9:
+            words.append(rng.choice(RARE_WORDS))
+        elif draw < 0.95:
+            words.append(rng.choice(ENGLISH_WORDS))
+        else:
+            words.append(rng.choice(SPECIAL_WORDS))
+    sentence = ' '.join(words)
+    return sentence[0].upper() + sentence[1:] + '.'
+
+
+def generate_corpus(n_documents=100, seed=0):
+    '''Synthetic French documents made of 1 to 5 paragraphs of 1 to 6 sentences.'''
+    rng = random.Random(seed)
+    return [
+        '\n\n'.join(
+            ' '.join(generate_sentence(rng) for _ in range(rng.randint(1, 6))) for _ in range(rng.randint(1, 5))
+        )
+        for _ in range(n_documents)
+    ]
+
+
+def use_offline_rank_indexes(rank_index_dir):
+    '''Build small rank indexes from the synthetic vocabulary, no embeddings are downloaded.'''
+    features.FASTTEXT_EMBEDDINGS_DIR = Path(rank_index_dir)
+    features.clear_rank_tables()
+    rng = random.Random(0)
+    fr_vocab = COMMON_WORDS + [word.lower() for word in SPECIAL_WORDS] + rng.sample(RARE_WORDS, 5)
+    en_vocab = ENGLISH_WORDS + ['the', 'of', 'and', 'to', 'in', 'is'] + rng.sample(COMMON_WORDS, 10)
+    for language, vocab in [('fr', fr_vocab), ('en', en_vocab)]:
+        build_rank_index(
+            vocab, features.get_rank_index_path(language=language), digest_vocab_size=features.DEFAULT_VOCAB_SIZE
+        )
+
+
+def use_offline_spacy_and_punkt_models(snapshot_dir):
+    '''Save a blank French spaCy pipeline and an untrained punkt model as the snapshots loaded instead of the models.'''
+    # Inline lazy imports because importing spacy and nltk is slow
+    import pickle
+
+    from nltk.tokenize.punkt import PunktSentenceTokenizer
+    import spacy
+
+    processing.SNAPSHOT_DIR = Path(snapshot_dir)
+    processing.SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    spacy.blank('fr').to_disk(get_spacy_snapshot_path(language='fr'))
+    with get_punkt_snapshot_path(language='fr').open('wb') as f:
+        pickle.dump(PunktSentenceTokenizer(), f)
+    configure_lemmatization('none')  # Also clears the loaded models, spacy-lefff would download its models
+
+
+def use_offline_resources(resources_dir):
+    resources_dir = Path(resources_dir)
+    use_offline_rank_indexes(resources_dir / 'ranks')
+    use_offline_spacy_and_punkt_models(resources_dir / 'snapshot')
+
+
+def timed(function, *args, **kwargs):
+    start_time = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start_time
+
+
+def get_percentiles(values):
+    values = sorted(values)
+    if len(values) == 0:
+        return {}
+    percentiles = {'mean': sum(values) / len(values)}
+    for percentile in [50, 90, 99]:
+        percentiles[f'p{percentile}'] = values[min(int(len(values) * percentile / 100), len(values) - 1)]
+    return percentiles
+
+
+def reset_caches():
+    # Each mode should start from the same state, otherwise the second one benefits from the caches of the first one
+    configure_spacy_doc_cache()
+    WORD_VERDICT_CACHE.clear()
+
+
+def get_peak_rss_mb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024 if sys.platform != 'darwin' else peak_rss / 1024 ** 2  # kB on Linux, bytes on macOS
+
+
+def generate_tokens(n_tokens=50000, seed=0):
+    '''Tokens of the synthetic corpus with their lowercased text as lemma, no spaCy pipeline needed.'''
+    rng = random.Random(seed)
+    tokens = []
+    while len(tokens) < n_tokens:
+        for word in generate_sentence(rng).split(' '):
+            tokens.append(CompactToken(word, 0, word.lower(), '', 0, False, False, False, ''))
+    return tokens[:n_tokens]
+
+
+def run_word_detector_benchmark(n_tokens=50000, seed=0):
+    '''Compare the per token word detectors with their vectorized versions on the same tokens.'''
+    tokens = generate_tokens(n_tokens, seed=seed)
+    word_detectors = features.get_word_detectors()
+    features.load_word_detector_resources()
+    per_token_duration = timed(lambda: [features.get_detected_types(token, word_detectors) for token in tokens])
+    batch_duration = timed(features.get_detected_types_batch, tokens, word_detectors)
+    return {
+        'n_tokens': n_tokens,
+        'per_token_tokens_per_s': n_tokens / per_token_duration,
+        'batch_tokens_per_s': n_tokens / batch_duration,
+        'batch_speedup': per_token_duration / batch_duration,
+    }
+
+
+def run_benchmark(n_documents=100, seed=0, n_process=1, batch_size=32, n_detector_tokens=50000):
+    cold_start = {'import_s': IMPORT_DURATION}
+    cold_start['spacy_model_s'] = timed(get_spacy_model, language='fr')
+    cold_start['rank_indexes_s'] = timed(features.load_word_detector_resources)
+    cold_start['punkt_s'] = timed(get_nltk_sentence_tokenizer, language='fr')
+
+    texts = generate_corpus(n_documents, seed=seed)
+    tokenizer = get_spacy_tokenizer(language='fr')
+    n_tokens = sum(len(tokenizer(text)) for text in texts)
+
+    reset_caches()
+    latencies = []
+    start_time = time.perf_counter()
+    for text in texts:
+        latencies.append(timed(get_detections, text))
+    single_duration = time.perf_counter() - start_time
+
+    reset_caches()
+    batch_duration = timed(lambda: list(get_detections_batch(texts, n_process=n_process, batch_size=batch_size)))
+
+    return {
+        'config': {'n_documents': n_documents, 'seed': seed, 'n_process': n_process, 'batch_size': batch_size},
+        'n_tokens': n_tokens,
+        'cold_start': cold_start,
+        'single': {
+            'latency_ms': {key: value * 1000 for key, value in get_percentiles(latencies).items()},
+            'docs_per_s': n_documents / single_duration,
+            'tokens_per_s': n_tokens / single_duration,
+        },
+        'batch': {'docs_per_s': n_documents / batch_duration, 'tokens_per_s': n_tokens / batch_duration},
+        'word_detectors': run_word_detector_benchmark(n_detector_tokens, seed=seed),
+        'peak_rss_mb': get_peak_rss_mb(),
+    }
+
+
+# Metrics compared against the baseline, with whether higher values are better
+REGRESSION_METRICS = {
+    'cold_start.spacy_model_s': False,
+    'cold_start.rank_indexes_s': False,
+    'cold_start.punkt_s': False,
+    'single.latency_ms.p50': False,
+    'single.latency_ms.p99': False,
+    'single.docs_per_s': True,
+    'batch.docs_per_s': True,
+    'word_detectors.batch_tokens_per_s': True,
+    'peak_rss_mb': False,
+}
+
+
+def get_metric(report, metric_name):
+    value = report
+    for key in metric_name.split('.'):
+        value = value[key]
+    return value
+
+
+def get_regressions(report, baseline, tolerance=0.2):
+    '''Metrics that are more than `tolerance` (relative) worse than in the baseline report.'''
+    regressions = {}
+    for metric_name, higher_is_better in REGRESSION_METRICS.items():
+        try:
+            value, baseline_value = get_metric(report, metric_name), get_metric(baseline, metric_name)
+        except KeyError:
+            continue
+        if higher_is_better:
+            is_regression = value < baseline_value * (1 - tolerance)
+        else:
+            is_regression = value > baseline_value * (1 + tolerance)
+        if is_regression:
+            regressions[metric_name] = {'value': value, 'baseline': baseline_value}
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-documents', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--n-process', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--offline', action='store_true', help='Use local stand-ins of the models')
+    parser.add_argument('--output-file', help='Where to write the JSON report')
+    parser.add_argument('--baseline-file', help='JSON report to compare with, exits with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Relative degradation allowed')
+    args = parser.parse_args()
+    if args.offline:
+        use_offline_resources(tempfile.mkdtemp())
+    report = run_benchmark(
+        n_documents=args.n_documents, seed=args.seed, n_process=args.n_process, batch_size=args.batch_size
+    )
+    print(json.dumps(report, indent=2))
+    if args.output_file is not None:
+        with open(args.output_file, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline_file is not None:
+        with open(args.baseline_file) as f:
+            regressions = get_regressions(report, json.load(f), tolerance=args.tolerance)
+        if len(regressions) > 0:
+            print(f'Regressions: {json.dumps(regressions, indent=2)}')
+            sys.exit(1)
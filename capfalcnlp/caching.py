@@ -0,0 +1,218 @@
+from collections import OrderedDict
+import json
+import os
+from pathlib import Path
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+
+class LRUCache:
+    '''Least recently used cache with hit, miss and eviction counters.
+
+    The cache is bounded by its number of items (`maxsize`) and/or by the estimated memory of its values (`max_bytes`),
+    estimated with the `sizeof` function.
+    Safe to share between threads, the operations hold a lock for the few dictionary operations they do.
+    '''
+
+    def __init__(self, maxsize=None, max_bytes=None, sizeof=sys.getsizeof):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data = OrderedDict()
+        self._sizes = {}
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else None  # Outside of the lock, can be slow
+        with self._lock:
+            self._pop(key)
+            if size is not None:
+                if size > self.max_bytes:
+                    return  # Would evict everything else
+                self._sizes[key] = size
+                self.n_bytes += size
+            self._data[key] = value
+            while (self.maxsize is not None and len(self._data) > self.maxsize) or (
+                self.max_bytes is not None and self.n_bytes > self.max_bytes
+            ):
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        key, _ = self._data.popitem(last=False)
+        self.n_bytes -= self._sizes.pop(key, 0)
+        self.evictions += 1
+
+    def _pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        self.n_bytes -= self._sizes.pop(key, 0)
+        return self._data.pop(key)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._pop(key, default)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def items(self):
+        '''(key, value) pairs from the least to the most recently used.'''
+        with self._lock:
+            return list(self._data.items())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.n_bytes = 0
+
+    def get_stats(self):
+        n_lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'n_bytes': self.n_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / n_lookups if n_lookups > 0 else None,
+        }
+
+
+class SQLiteCache:
+    '''Persistent key value cache stored in a SQLite file, safe to share between processes.
+
+    Values are JSON serializable objects. When the total size of the stored values exceeds `max_bytes`, the least
+    recently accessed entries are evicted.
+    Hits only write the access time of entries that were not accessed for `access_update_interval` seconds, so that
+    reads do not all take the write lock. The total size is maintained by triggers in a `meta` row.
+    '''
+
+    def __init__(self, path, max_bytes=1024 ** 3, eviction_check_interval=100, access_update_interval=60):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.eviction_check_interval = eviction_check_interval
+        self.access_update_interval = access_update_interval
+        self._local = threading.local()
+        self._n_puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._get_connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)')
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            # Caches created before the meta table start from the size of their entries
+            connection.execute(
+                "INSERT OR IGNORE INTO meta (name, value) SELECT 'n_bytes', COALESCE(SUM(size), 0) FROM cache"
+            )
+            connection.execute(
+                'CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN '
+                "UPDATE meta SET value = value + NEW.size WHERE name = 'n_bytes'; END"
+            )
+            connection.execute(
+                'CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF size ON cache BEGIN '
+                "UPDATE meta SET value = value + NEW.size - OLD.size WHERE name = 'n_bytes'; END"
+            )
+            connection.execute(
+                'CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN '
+                "UPDATE meta SET value = value - OLD.size WHERE name = 'n_bytes'; END"
+            )
+
+    def _get_connection(self):
+        # SQLite connections can not be shared across threads nor inherited by forked processes
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(str(self.path), timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')  # Concurrent readers with one writer
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, key, default=None):
+        connection = self._get_connection()
+        row = connection.execute('SELECT value, last_access FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        value, last_access = row
+        now = time.time()
+        if now - last_access > self.access_update_interval:
+            with connection:
+                connection.execute('UPDATE cache SET last_access = ? WHERE key = ?', (now, key))
+        return json.loads(zlib.decompress(value).decode('utf8'))
+
+    def put(self, key, value):
+        compressed_value = zlib.compress(json.dumps(value, ensure_ascii=False).encode('utf8'))
+        connection = self._get_connection()
+        with connection:
+            # Upsert rather than INSERT OR REPLACE, whose implicit delete does not fire the delete trigger
+            connection.execute(
+                'INSERT INTO cache (key, value, size, last_access) VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+                'value = excluded.value, size = excluded.size, last_access = excluded.last_access',
+                (key, compressed_value, len(compressed_value), time.time()),
+            )
+        self._n_puts += 1
+        if self._n_puts % self.eviction_check_interval == 0:
+            self.evict()
+
+    def get_n_bytes(self):
+        return self._get_connection().execute("SELECT value FROM meta WHERE name = 'n_bytes'").fetchone()[0]
+
+    def evict(self):
+        '''Remove the least recently accessed entries until the cache fits in `max_bytes`.'''
+        connection = self._get_connection()
+        n_bytes_to_free = self.get_n_bytes() - self.max_bytes
+        if n_bytes_to_free <= 0:
+            return
+        keys_to_evict = []
+        for key, size in connection.execute('SELECT key, size FROM cache ORDER BY last_access'):
+            keys_to_evict.append((key,))
+            n_bytes_to_free -= size
+            if n_bytes_to_free <= 0:
+                break
+        with connection:
+            connection.executemany('DELETE FROM cache WHERE key = ?', keys_to_evict)
+        self.evictions += len(keys_to_evict)
+
+    def clear(self):
+        with self._get_connection() as connection:
+            connection.execute('DELETE FROM cache')
+
+    def get_stats(self):
+        n_lookups = self.hits + self.misses
+        return {
+            'n_bytes': self.get_n_bytes(),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / n_lookups if n_lookups > 0 else None,
+        }
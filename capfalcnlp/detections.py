@@ -0,0 +1,172 @@
+'''Compact detection results stored as parallel arrays.
+
+A `Detections` object stores the character offset, length and detected type code of each detection in typed arrays
+(a few bytes per detection) and references the analysed text instead of copying the detected substrings. Iterating
+over it or calling `to_dicts()` gives the usual list of {'text', 'char_offset', 'detected_type'} dicts.
+'''
+from array import array
+from collections.abc import Sequence
+import json
+from pathlib import Path
+
+
+class Detections(Sequence):
+    '''Detections of a text, each item is a {'text', 'char_offset', 'detected_type'} dict built on access.
+
+    `text` can be None when the source text is not available (e.g. loaded from a columnar file without the texts), the
+    items then have no 'text' key.
+    '''
+
+    def __init__(self, text=None, char_offsets=(), lengths=(), type_codes=(), detected_types=()):
+        self.text = text
+        self.char_offsets = array('I', char_offsets)
+        self.lengths = array('I', lengths)
+        self.type_codes = array('H', type_codes)
+        self.detected_types = list(detected_types)  # Type code -> detected type name
+        self._type_codes = {detected_type: code for code, detected_type in enumerate(self.detected_types)}
+
+    def get_type_code(self, detected_type):
+        code = self._type_codes.get(detected_type)
+        if code is None:
+            code = self._type_codes[detected_type] = len(self.detected_types)
+            self.detected_types.append(detected_type)
+        return code
+
+    def append(self, char_offset, length, detected_type):
+        self.char_offsets.append(char_offset)
+        self.lengths.append(length)
+        self.type_codes.append(self.get_type_code(detected_type))
+
+    def __len__(self):
+        return len(self.char_offsets)
+
+    def _get_item(self, i):
+        char_offset = self.char_offsets[i]
+        detection = {'char_offset': char_offset, 'detected_type': self.detected_types[self.type_codes[i]]}
+        if self.text is None:
+            return detection
+        return {'text': self.text[char_offset : char_offset + self.lengths[i]], **detection}
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._get_item(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Detection index out of range')
+        return self._get_item(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get_item(i)
+
+    def __eq__(self, other):
+        if isinstance(other, Detections):
+            other = other.to_dicts()
+        return self.to_dicts() == other
+
+    def __repr__(self):
+        return f'Detections({self.to_dicts()!r})'
+
+    def to_dicts(self):
+        '''List of dicts view, as returned by `get_detections`.'''
+        return list(self)
+
+    @classmethod
+    def from_dicts(cls, text, detections):
+        compact_detections = cls(text)
+        for detection in detections:
+            length = len(detection['text']) if 'text' in detection else 0
+            compact_detections.append(detection['char_offset'], length, detection['detected_type'])
+        return compact_detections
+
+    def to_columns(self):
+        '''JSON serializable columns, the detected substrings are not included.'''
+        return {
+            'char_offsets': self.char_offsets.tolist(),
+            'lengths': self.lengths.tolist(),
+            'type_codes': self.type_codes.tolist(),
+            'detected_types': self.detected_types,
+        }
+
+    @classmethod
+    def from_columns(cls, text, columns):
+        return cls(text, **columns)
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_columns(), **kwargs)
+
+    def __getstate__(self):
+        # Arrays pickle compactly, the interning dict is rebuilt on load
+        return {'text': self.text, **self.to_columns()}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def write_jsonl(documents, output_file, columns=True):
+    '''Write one JSON line per (document_id, detections) pair, either columnar or as the list of dicts.'''
+    for document_id, detections in documents:
+        if columns:
+            line = json.dumps({'id': document_id, **detections.to_columns()}, ensure_ascii=False)
+        else:
+            line = json.dumps({'id': document_id, 'detections': detections.to_dicts()}, ensure_ascii=False)
+        output_file.write(line + '\n')
+
+
+def save_npz(filepath, documents):
+    '''Save the (document_id, detections) pairs in a single NumPy .npz file of concatenated columns.
+
+    `document_ends[i]` is the index after the last detection of the i-th document, type codes are remapped to the
+    shared `detected_types` table.
+    '''
+    # Inline lazy import because numpy is only needed for this export
+    import numpy as np
+
+    document_ids = []
+    document_ends = array('Q')
+    char_offsets = array('I')
+    lengths = array('I')
+    type_codes = array('H')
+    detected_type_codes = {}
+    for document_id, detections in documents:
+        code_mapping = [
+            detected_type_codes.setdefault(detected_type, len(detected_type_codes))
+            for detected_type in detections.detected_types
+        ]
+        document_ids.append(str(document_id))
+        char_offsets.extend(detections.char_offsets)
+        lengths.extend(detections.lengths)
+        type_codes.extend(code_mapping[code] for code in detections.type_codes)
+        document_ends.append(len(char_offsets))
+    np.savez_compressed(
+        Path(filepath),
+        document_ids=np.array(document_ids, dtype=str),
+        document_ends=np.asarray(document_ends, dtype=np.uint64),
+        char_offsets=np.asarray(char_offsets, dtype=np.uint32),
+        lengths=np.asarray(lengths, dtype=np.uint32),
+        type_codes=np.asarray(type_codes, dtype=np.uint16),
+        detected_types=np.array(list(detected_type_codes), dtype=str),
+    )
+
+
+def load_npz(filepath, texts=None):
+    '''Load the (document_id, detections) pairs saved with `save_npz`, `texts` are the documents texts in order.'''
+    import numpy as np
+
+    with np.load(Path(filepath)) as data:
+        columns = {name: data[name] for name in data.files}  # Each access to `data` decompresses the array again
+    detected_types = columns['detected_types'].tolist()
+    documents = []
+    start = 0
+    for i, (document_id, end) in enumerate(zip(columns['document_ids'].tolist(), columns['document_ends'].tolist())):
+        detections = Detections(
+            None if texts is None else texts[i],
+            columns['char_offsets'][start:end].tolist(),
+            columns['lengths'][start:end].tolist(),
+            columns['type_codes'][start:end].tolist(),
+            detected_types,
+        )
+        documents.append((document_id, detections))
+        start = end
+    return documents
@@ -1,10 +1,13 @@
+from collections import deque
 from functools import lru_cache
+import hashlib
+from itertools import islice
+import json
 import math
-import shutil
+from pathlib import Path
 import string
 import re
-
-import spacy
+import threading
 
 from capfalcnlp.processing import (
     remove_multiple_whitespaces,
@@ -12,44 +15,155 @@ from capfalcnlp.processing import (
     split_in_sentences,
     count_content_tokens,
     spacy_process,
+    spacy_pipe,
+    get_spacy_model,
+    get_disabled_pipes,
+    get_nltk_sentence_tokenizer,
+    get_sentence_spans,
+    count_content_tokens_in_spans,
+    get_spacy_doc_cache_stats,
+    save_spacy_model_snapshot,
+    save_nltk_sentence_tokenizer_snapshot,
+    use_thread_local_spacy_models,
 )
-from capfalcnlp.paths import FASTTEXT_EMBEDDINGS_DIR
-from capfalcnlp.helpers import yield_lines, download_and_extract, download
+from capfalcnlp.paths import FASTTEXT_EMBEDDINGS_DIR, RESOURCES_DIR
+from capfalcnlp.helpers import yield_lines, yield_lines_from_url
+from capfalcnlp.ranks import RANK_INDEX_VERSION, RankIndex, build_rank_index, get_rank_index_version
+from capfalcnlp.caching import LRUCache, SQLiteCache
+from capfalcnlp.detections import Detections
+from capfalcnlp.lexicon import AhoCorasick, get_leftmost_longest_matches, load_lexicon_file
+from capfalcnlp.profiling import GLOBAL_PROFILER, format_prometheus, profile_stage, record
 
 
-def download_fasttext_embeddings_if_needed(language='fr', training_corpus='common_crawl'):
-    # TODO: Repeated code
+def get_fasttext_embeddings_url(language='fr', training_corpus='common_crawl'):
     if training_corpus == 'common_crawl':
-        fasttext_embeddings_path = FASTTEXT_EMBEDDINGS_DIR / f'cc.{language}.300.vec'
-        url = f'https://dl.fbaipublicfiles.com/fasttext/vectors-crawl/cc.{language}.300.vec.gz'
-        if not fasttext_embeddings_path.exists():
-            fasttext_embeddings_path.parent.mkdir(parents=True, exist_ok=True)
-            shutil.move(download_and_extract(url)[0], fasttext_embeddings_path)
+        return f'https://dl.fbaipublicfiles.com/fasttext/vectors-crawl/cc.{language}.300.vec.gz'
     elif training_corpus == 'wikipedia':
-        fasttext_embeddings_path = FASTTEXT_EMBEDDINGS_DIR / f'wiki.{language}.vec'
-        url = f'https://dl.fbaipublicfiles.com/fasttext/vectors-wiki/wiki.{language}.vec'
-        if not fasttext_embeddings_path.exists():
-            fasttext_embeddings_path.parent.mkdir(parents=True, exist_ok=True)
-            shutil.move(download(url), fasttext_embeddings_path)
+        return f'https://dl.fbaipublicfiles.com/fasttext/vectors-wiki/wiki.{language}.vec'
     else:
         raise NotImplementedError(f'Training corpus {training_corpus} not recognized')
+
+
+def get_fasttext_embeddings_path(language='fr', training_corpus='common_crawl'):
+    return FASTTEXT_EMBEDDINGS_DIR / get_fasttext_embeddings_url(language, training_corpus).split('/')[-1].replace(
+        '.gz', ''
+    )
+
+
+def download_fasttext_embeddings_if_needed(language='fr', training_corpus='common_crawl'):
+    # Inline lazy import because the fetcher is only needed the first time
+    from capfalcnlp.fetching import fetch, fetch_and_extract
+
+    fasttext_embeddings_path = get_fasttext_embeddings_path(language, training_corpus)
+    url = get_fasttext_embeddings_url(language, training_corpus)
+    if not fasttext_embeddings_path.exists():
+        # Decompressed while downloading, or taken from a local mirror (see capfalcnlp.fetching)
+        if url.endswith('.gz'):
+            fetch_and_extract(url, fasttext_embeddings_path)
+        else:
+            fetch(url, fasttext_embeddings_path)
     return fasttext_embeddings_path
 
 
+DEFAULT_VOCAB_SIZE = 10 ** 5
+
+
+def get_rank_index_path(vocab_size=DEFAULT_VOCAB_SIZE, language='fr', training_corpus='common_crawl'):
+    return FASTTEXT_EMBEDDINGS_DIR / f'{training_corpus}.{language}.{vocab_size}.ranks'
+
+
+def get_rank_index_vocab_sizes(language='fr', training_corpus='common_crawl'):
+    '''Vocabulary sizes of the rank indexes of the language already built, in increasing order.'''
+    pattern = re.compile(rf'{re.escape(training_corpus)}\.{re.escape(language)}\.(\d+)\.ranks')
+    matches = [pattern.fullmatch(path.name) for path in FASTTEXT_EMBEDDINGS_DIR.glob('*.ranks')]
+    return sorted(int(match.group(1)) for match in matches if match is not None)
+
+
+def yield_fasttext_vocab(
+    vocab_size=DEFAULT_VOCAB_SIZE, language='fr', training_corpus='common_crawl', stream=True, url=None
+):
+    '''Yield the `vocab_size` most frequent words of the fastText embeddings.
+
+    When the embeddings are not available locally and `stream` is True, the (possibly gzipped) HTTP response is
+    decompressed on the fly and the connection is closed after `vocab_size` words, instead of downloading the full file.
+    '''
+    fasttext_embeddings_path = get_fasttext_embeddings_path(language, training_corpus)
+    if fasttext_embeddings_path.exists() or not stream:
+        line_generator = yield_lines(download_fasttext_embeddings_if_needed(language, training_corpus))
+    else:
+        if url is None:
+            from capfalcnlp.fetching import get_mirror_path
+
+            url = get_fasttext_embeddings_url(language, training_corpus)
+            mirror_path = get_mirror_path(url)
+            if mirror_path is not None:
+                url = mirror_path.resolve().as_uri()
+        line_generator = yield_lines_from_url(url)
+    try:
+        next(line_generator)  # Skip the first line (header)
+        for line in islice(line_generator, vocab_size):
+            yield line.split(' ')[0]
+    finally:
+        line_generator.close()
+
+
+def build_rank_index_if_needed(vocab_size=DEFAULT_VOCAB_SIZE, language='fr', training_corpus='common_crawl', **kwargs):
+    rank_index_path = get_rank_index_path(vocab_size, language, training_corpus)
+    if not rank_index_path.exists() or get_rank_index_version(rank_index_path) != RANK_INDEX_VERSION:
+        vocab = yield_fasttext_vocab(vocab_size, language, training_corpus, **kwargs)
+        build_rank_index(vocab, rank_index_path, digest_vocab_size=DEFAULT_VOCAB_SIZE)
+    return rank_index_path
+
+
+_RANK_TABLES = {}  # (language, training_corpus) -> (vocab_size, RankIndex) of the largest vocabulary loaded
+_RANK_TABLES_LOCK = threading.Lock()
+RANK_INDEX_USE_DICT = False  # See configure_rank_indexes
+
+
+def get_rank_table(vocab_size=DEFAULT_VOCAB_SIZE, language='fr', training_corpus='common_crawl'):
+    '''Rank index of the language shared by all the vocabulary sizes, covering at least `vocab_size` words.
+
+    The largest index already built is loaded once, a larger one is only built (and replaces it) when a bigger
+    `vocab_size` is requested.
+    '''
+    key = (language, training_corpus)
+    with _RANK_TABLES_LOCK:
+        if key not in _RANK_TABLES or _RANK_TABLES[key][0] < vocab_size:
+            index_vocab_size = max([vocab_size, *get_rank_index_vocab_sizes(language, training_corpus)])
+            # Memory-mapped, the pages are shared by all the processes that load the same index
+            with profile_stage('ranks.load'):
+                rank_index_path = build_rank_index_if_needed(index_vocab_size, language, training_corpus)
+                rank_index = RankIndex(rank_index_path, use_dict=RANK_INDEX_USE_DICT)
+            is_replaced = key in _RANK_TABLES
+            _RANK_TABLES[key] = (index_vocab_size, rank_index)
+            if is_replaced:
+                # The cached views would keep the smaller index mapped, they are recreated on the new one
+                get_word2rank.cache_clear()
+        return _RANK_TABLES[key][1]
+
+
 @lru_cache()
-def get_word2rank(vocab_size=10 ** 5, language='fr', training_corpus='common_crawl'):
-    word2rank = {}
-    line_generator = yield_lines(download_fasttext_embeddings_if_needed(language, training_corpus))
-    next(line_generator)  # Skip the first line (header)
-    for i, line in enumerate(line_generator):
-        if (i + 1) > vocab_size:
-            break
-        word = line.split(' ')[0]
-        word2rank[word] = i
-    return word2rank
+def get_word2rank(vocab_size=DEFAULT_VOCAB_SIZE, language='fr', training_corpus='common_crawl'):
+    # {word: rank} view of the shared rank index restricted to the `vocab_size` most frequent words
+    return get_rank_table(vocab_size, language, training_corpus).view(vocab_size)
+
+
+def clear_rank_tables():
+    with _RANK_TABLES_LOCK:
+        _RANK_TABLES.clear()
+    get_word2rank.cache_clear()
+    WORD_VERDICT_CACHE.clear()  # Computed from the ranks of the previous tables
+
+
+def configure_rank_indexes(use_dict=False):
+    '''Decode the rank indexes to per-process dicts (faster lookups, more memory) instead of probing mapped pages.'''
+    global RANK_INDEX_USE_DICT
+    RANK_INDEX_USE_DICT = use_dict
+    clear_rank_tables()
 
 
 def get_rank(word, **kwargs):
+    '''Rank of the word among the `vocab_size` most frequent words (keyword argument), inf when it is not among them.'''
     word2rank = get_word2rank(**kwargs)
     return word2rank.get(word, float('inf'))
 
@@ -58,10 +172,43 @@ def get_log_rank(word, **kwargs):
     return math.log(1 + get_rank(word, **kwargs))
 
 
+def get_ranks(words, **kwargs):
+    '''Ranks of all the words at once as a float NumPy array, inf for words out of the vocabulary.'''
+    # Inline lazy import because importing numpy is slow
+    import numpy as np
+
+    return np.array(get_word2rank(**kwargs).get_many(words, default=float('inf')), dtype=float)
+
+
+def _to_bool_array(values):
+    import numpy as np
+
+    return np.array(values, dtype=bool)
+
+
+def requires(*requirements):
+    '''Declare the token attributes a word detector needs: 'text', 'lemma', 'pos' or 'entities'.
+
+    The requirements are used to only run the spaCy pipeline components needed by the requested detectors.
+    '''
+
+    def decorator(detector):
+        detector.requirements = frozenset(requirements)
+        return detector
+
+    return decorator
+
+
+NUMBER_REGEX = re.compile(r'^[+-]?(?:[0-9]*[.,])*[0-9]+$')
+ACCRONYM_REGEX = re.compile(r'^(?:[A-Z]\.?)+$')
+TIME_REGEX = re.compile(r'\d+[hH:]\d*')
+PUNCTUATION_CHARACTERS = frozenset(string.punctuation + '’' + '\n')
+
+
+@requires('text')
 def is_number(word):
     word = str(word)
-    float_regex = '^[+-]?(?:[0-9]*[.,])*[0-9]+$'
-    return re.match(float_regex, word) is not None
+    return NUMBER_REGEX.match(word) is not None
 
 
 def clean_text(text):
@@ -74,64 +221,119 @@ def is_written_in_capitals(word):
     return word.upper() == word and word.lower() != word  # The second test excludes strings like '2002' or '.'
 
 
+@requires('text')
 def is_frequent_word_written_in_capitals(word, rank_threshold=50000, language='fr', **kwargs):
     word = str(word)
-    return is_written_in_capitals(word) and get_rank(word.lower(), language='fr', **kwargs) < rank_threshold
+    return is_written_in_capitals(word) and get_rank(word.lower(), language=language, **kwargs) < rank_threshold
 
 
-def is_english_word(word):
+@requires('lemma')
+def is_english_word(word, rank_ratio=5, fr_rank_threshold=15000, en_rank_threshold=5000, vocab_size=DEFAULT_VOCAB_SIZE):
     # Example usage:
     # for word in ['patient', 'exclusive', 'vice', 'instance', 'cause', 'cigarette', 'hall', 'former', 'notification', 'agent', 'fax', 'satisfaction', 'condition', 'algorithm', 'feature', 'meeting', 'call', 'afterwork', 'jetlag', 'smartphone']:  # noqa
     #     print(word, is_english_word(word), get_rank(word, language='fr'), get_rank(word, language='en'))
     word = cast_to_lemma_if_possible(word)
-    return (
-        get_rank(word, language='fr') > 5 * get_rank(word, language='en')
-        or get_rank(word, language='fr') > 15000
-        and get_rank(word, language='en') < 5000
-    )
+    fr_rank = get_rank(word, language='fr', vocab_size=vocab_size)
+    en_rank = get_rank(word, language='en', vocab_size=vocab_size)
+    return fr_rank > rank_ratio * en_rank or fr_rank > fr_rank_threshold and en_rank < en_rank_threshold
 
 
 def cast_to_lemma_if_possible(word):
-    if isinstance(word, spacy.tokens.token.Token):
+    if hasattr(word, 'lemma_'):  # spaCy token or CompactToken, checked without importing spaCy
         word = word.lemma_
     return word
 
 
-def is_rare_word(word, rank_threshold=3500):
+@requires('lemma')
+def is_rare_word(word, rank_threshold=3500, vocab_size=DEFAULT_VOCAB_SIZE):
     word = cast_to_lemma_if_possible(word)
-    return get_rank(word.lower()) > rank_threshold and not is_number(word)
+    return get_rank(word.lower(), vocab_size=vocab_size) > rank_threshold and not is_number(word)
 
 
+@requires('text')
 def is_accronym(word):
     word = str(word)
-    return re.match(r'^(?:[A-Z]\.?)+$', word) is not None and not is_frequent_word_written_in_capitals(word)
+    return ACCRONYM_REGEX.match(word) is not None and not is_frequent_word_written_in_capitals(word)
+
+
+# From 'https://fr.wiktionary.org/wiki/Annexe:Abr%C3%A9viations_en_fran%C3%A7ais'
+# fmt: off
+ABBREVIATIONS = ['1re', '2d', '2de', '1o', '2o', '3o', '7bre', '8bre', '9bre', '10bre', 'A.C.N.', 'ad lib.', 'A.M.', 'ann.', 'app.', 'appt', 'apr.', 'arrt', 'a/s', '℁', 'auj.', 'avc', 'ac', 'BAC', 'B.À.T.', 'b.à.t.', 'bât.', 'bt', 'bcp', 'bd', 'boul.', 'B.P.', 'BTP', 'ca.', 'circa', 'c.-à-d.', 'c.a.d.', 'Cal', 'c. à s.', 'c/s', 'c.c.', 'c/c', 'cc', 'C.C.', 'Cdt', 'cdmt', 'cedex', 'Cel', 'ch.', 'ch.-l.', 'chauff', 'chap.', 'Chr', 'Cie', 'C.N.', 'Cne', 'C.N.S.', 'c/o', 'a/s', '℁', 'contr.', 'C.P.I.', 'cpdt', 'C.Q.F.D', 'crs.', 'C.S.', 'Cte', 'Ctesse', 'dc', 'Dir.', 'dº', 'dito', 'doct.', 'dpdv', 'ds', 'dsl', 'dvlpt', 'dvt', 'ê', 'e. g.', 'e.g.', 'env.', 'et al.', 'cie', 'Éts', 'Ets', 'E.V.', 'exp', 'fact.', 'fasc.', 'féd.', 'fém.', 'févr.', 'FF', 'ff.', 'fg', 'fig.', 'fin.', 'fl.', 'fo', 'fº', 'fol.', 'fos', 'fr.', 'FRF', 'ft', 'fts', 'Gal', 'gd', 'gon', 'hab.', 'HS', 'ibid.', 'id.', 'i. e.', 'id est', 'c.-à-d.', 'inf.', 'Ing.', 'Ir', 'JF', 'JH', 'jms', 'J.O.', 'JO', 'K7', 'l. c.', 'L.D.', 'LL.AA.', 'LL.AA.II.', 'LL.AA.RR.', 'LL.AA.SS.', 'LL.EE.', 'LL.MM.', 'LL.MM.II.RR.', 'LOC', 'loc. cit.', 'Lt', 'méga', 'm̂', 'M.A.', 'Moyen Âge', 'màj', 'm-à-j', 'Mal', 'masc.', 'Md', 'Md', 'm.g.', 'Mgr', 'Mlle', 'Mlles', 'MM.', 'Mmes', 'ms.', 'mtn', 'NA', 'N/A', 'n/a', 'N.B.', 'N.D.', 'N.D.A.', 'N.D.L.R.', 'N.D.T.', 'N.D.W.', 'N.N.', 'NN.SS.', 'Nº', 'nº', 'N.P.A.I.', 'n/réf.', 'ns', 'N.S.', 'op. cit.', 'opt', 'pb', 'p.c.c.', 'pcq', 'p.c.q.', 'P.-D. G.', 'pdt', 'p.ex.', 'p.j.', 'P.J.', 'pk', 'pq', 'pl.', 'plrs', 'pls', 'p/o', 'p.p.', 'Pr', 'P.-S.', 'P.S.', 'pt', 'Pt', 'pt', 'pts', 'pte', 'PTI', 'PV', 'qcq', 'qd', 'QED', 'qq', 'qqch', 'qqf', 'qqf.', 'qqn', 'qqpt', 'qsp', 'qté', 'qté', 'qdm', 'R.T.F.M', 'RTFM', 'R.A.S.', 'R.À.S.', 'rd', 'R.-V.', 'RV', 'rdv', 'REP', 'R.I.P.', 'ro', 'rº', 'RLMI', 'R.P.', 'R. P.', 'RSVP', 's/', 'S.A.', 'S.A.I.', 'S.A.R.', 'S.A.S.', 's/c', 'Sce', 'Sce', 's.d.', 'SDF', 'S.E.', 'Ste', 'Ste', 'sec.', 'sect.', 'SGDG', 'sing.', 's.l.', 'slt', 'S.M.', 'S.M.I.R.', 's/o', 'spec', 'sq.', 'sqq.', 'ss', 's/s', 'SS.', 'Sts', 'Sts', 'ssi', 'Ste', 'Ste', 'Stes', 'Stes', 'S.S.', 'sté', 'Sté', 'stp', 'STP', 'suiv.', 'sup.', 'suppl.', 'svp', 'SVP', 't.', 'tél.', 'téléc.', 'TGV', 'tgv', 'tjrs', 'tjs', 'tlm', 'TPS', 'tq', 'ts', 'TSA', 'T.S.V.P.', 'tt', 'vb.', 'Ve', 'vo', 'vº', 'v/réf', 'vs.', 'V.S.O.P.', 'v .t.', 'Vte', 'Vtesse', 'Vve', 'XL', 'XXL', 'XXXL', 'TTTG', 'X.O.', 'XS', 'TP', 'y c.', 'Z.A.', 'Z.A.C.', 'Z.I.', 'ZUP', 'zup', 'aa', 'ab', 'ac', 'ae', 'af', 'ag', 'aj', 'ak', 'ao', 'ap', 'aq', 'ar', 'aw', 'ax', 'ay', 'az', 'ba', 'bb', 'bc', 'bd', 'bf', 'bg', 'bh']  # noqa
+# fmt: on
+# From https://fr.wiktionary.org/wiki/Annexe:Liste_de_termes_d%E2%80%99argot_Internet
+# fmt: off
+SLANG_WORDS = ['@tt', '@tte', 'a tte', 'a12c4', 'a2m1', '2m1', 'abs', 'ac', 'ak', 'aek', 'avc', 'av', 'ajd', 'oj', 'auj', 'ajdh', 'apl', 'a+', '++', '@+', '++++', 'à+', 'ama', 'amha', 'arf', 'erf', 'asv', 'att', 'atta', 'b1', 'bb', 'bp', 'bcp', 'bg', 'bj', 'bjr', 'bsr', 'biz', 'bsx', 'bx', 'bn', 'b8', 'btg', 'bvo', 'c', 'cad', 'càd', 'cbr', 'cc', 'couc', 'chu', 'chuis', 'cki', 'cmr' 'cmer', 'cb', 'cmb', 'ctb', 'ctup', 'cpg', 'pas rave', 'crari', 'ctc', 'dac', 'dacc', 'dak', 'dc', 'dcdr', 'déc-redéc', 'déco-reco', 'dmc', 'dtc', 'dsc', 'dr', 'dsl', 'dtf', 'ect', 'ec', 'ets', 'fd’a', 'fdg', 'fdp', 'ff', 'fpc', 'fr', 'fra', 'ftg', 'gb', 'geta', 'gnih', 'gné', 'gp', 'hg', 'hs', 'hihi', 'htkc', 'jam', 'jdc', 'jdr', 'jdçdr', 'jmef', 'jpp', 'jre', 'je re', 'jrb', 'jta', 'jtad', 'jtdr', 'jtd', 'jtb(f)', 'jtkc', 'jtl(g)', 'jtm', 'j’tm', 'j’t’<3', 'j’tmz', 'jts', 'k.', 'kk', 'kay', 'K7', 'KC', 'kestuf', 'kdo', 'ki', 'kiss', 'kikoo', 'kikou', 'kikoolol', 'klr', 'clr', 'koi', 'kwa', 'koi29', 'koid9', 'lgtmp(s)', 'lgt', 'loule', 'loul', 'lal(e)', 'lold', 'laule', 'lolilol', 'lu', 'lut', 'merki', 'mici', 'mci', 'ci', 'miki', 'mdb', 'mdp', 'mdr', 'mi', 'mm', 'mouaha', 'mouhaha', 'mp', 'mpm', 'ms', 'msg', 'mtnt', 'mnt', 'mwa', 'moa', 'moua', 'ndc', 'nn', 'nan', 'na', 'nop(e)', 'noraj', 'nrv', 'ns', 'nspc', 'ntm', 'nptk', 'oki', 'ololz', 'osef', 'osefdtl', 'osefdts', 'osefdtv', 'oseb', 'ouer', 'ué', 'uè', 'vi', 'mui', 'moui', 'wé', 'woué', 'yep', 'ouep', 'ouè', 'oué', 'oé', 'oè', 'ui', 'wé', 'uep', 'vui', 'voui', 'yup', 'ouai', 'ouais', 'pb', 'pd', 'pde', 'pdt', 'plop', 'pouet', 'poy', 'yop', 'plv', 'ptdr', 'pk', 'pq', 'prq', 'prk', 'pkoi', 'pr', 'psk', 'pck', 'pq', 'pke', 'pcq', 'p-t', 'p-e', 'pê', 'ppda', 'pqtam', 'ptafqm', 'put1', 'pt1', 'tain', "p't", 'ptn', 'pv', 'qq1', 'kk1', 'qqn', 'qqun', 'rab', 'raf', 'ras', 'rav', 'raz', 'razer', 'rb', 'rep', 're reuh', 're-salut', 'rgd', 'roh', 'rtva', 'rtl', 'slt', 'snn', 'spd', 'spj', 'ss', 'j’ss', 'jss', 'st', 'staive', 'srx', 'stoo', 'stp', 'svp', 'talc', 'tdf', 'teuf', 'tfk', 'tftc', 'tg', 'taggle', 'th', 'tgv', 'tjrs', 'tjs', 'tjr', 'tof', 'tkl', 'tkt', 'tlm', 'tllmnt', 'tllmt', 'tmlt', 'tmtc', 'tmts', 'tpm', 'tps', 'tsé', 'tt', 'tte', 'ts', 'ttt', 'twa', 'toa', 'toua', 'toé', 'vg', 'voggle', 'vmk', 'vmvc', 'vmvs', 'vnr', 'vo', 'vost', 'vostfr', 'vtfe', 'vtff', 'vtv', 'vouai', 'mouai', 'vs', 'wi', 'wè', 'wai', 'wé', 'weta', 'xl', 'xlt', 'xdr', 'xpdr', 'xpldr', 'yop', 'zik', '+1', '-1', '*', 'afaik', 'afk', 'aka', 'anw', 'aright', 'asap', 'asc', 'asd', 'asl', 'atfg', 'b', 'bb', 'bbl', 'bbq', 'bbs', 'b/f', 'bf', 'brb', 'bs', 'btw', 'cu ', 'cu2', 'cul', 'cus', 'coz', 'cr', 'cya', 'ded', 'dl', 'ddl', 'del', 'dnftt', 'elf', 'err', 'fb', 'fbc', 'ffs', 'FPS', 'ftl', 'ftf', 'ftw', 'fyi', 'fu', 'fy', 'fwiw', 'g2g', 'geek', 'gf', 'gfy', 'g/f', 'gg', 'giyf', 'gj', 'gl', 'gtg', 'gn8', 'gr8', 'gtfo', 'hf', 'hp', 'hs', 'hth', 'hbtl', 'ianal', 'idk', 'ig', 'iirc', 'igam', 'ily', 'imho', 'imo', 'imy', 'irl', 'iwhbtl', 'iykwim', 'kos', 'lol', 'lo', 'lmao', 'lmfao', 'lol', 'luv', 'l2p', 'mol', 'm2c', 'm8', 'n', 'n1', 'nbd', 'ne1', 'neways', 'nh', 'nk', 'noob', 'naab', 'np', 'nop', 'ns', 'nt', 'nm', 'nm', 'nsfw', 'nvm', 'nw', 'ofc', 'oic', 'omc', 'omg', 'amagad', 'omj', 'omo', 'omfg', 'omw', 'o rly', 'otf', 'otw', 'owj', 'owned ', 'pwnd ', 'etc.', 'p911', 'pix', 'pk', 'plz', 'pol', 'pos', 'pgm', 'pw(d)', 'pwned', 'r', 'rly', 'o rly', 'rdy', 'rfyl', 'rofl', 'rofl', 'rotfl', 'r0fl', 'roflmao', 'rp', "r'pZ", 'rtfm', 'littéralement', 'rtk', 'sec brb', 'sfw', 'Shawol', 'so', 'srsly', 'sry', 'su', 'Ssup', 'STFU', 'STFW', 'sx', 'thx/ty', 'tk', 'tl;dr', 'toycn', 'troll', 'ttyl', 'u', 'up', 'usa', 'ur', 'Wassup', 'w8', 'wb', 'woot', 'wp', 'wtf', 'wtfg', 'wtg', 'wth', 'wtj', 'wuup2', 'y', 'ya rly', 'yafa', 'ygam', 'ymmv', 'yw', 'acias', 'ara', 'dsps', 'iwal', 'jaja', 'jeje', 'jiji', 'jojo', 'jd', 'kerer', 'mñn', 'muxo', 'pq', 'pk', "qva!", 'ta', 'tb', 'tp', 'tqp', 'weno', 'güeno', 'x', 'xuxa', 'a+', 'asv', 'bcp', 'dsl', 'lol', 'mdr', 'ptdr', 'rotfl', 'slt', 'tlm', '+1', 'plop', 're']  # noqa
+# fmt: on
+EXTRA_LEXICON_PATHS = []
+
+
+def add_lexicon_file(filepath):
+    '''Add the entries of a user lexicon file (one entry per line) to the abbreviations detected in the texts.'''
+    EXTRA_LEXICON_PATHS.append(filepath)
+    get_abbreviation_lexicon.cache_clear()
+    get_abbreviation_matcher.cache_clear()
+    _get_detection_config_fingerprint.cache_clear()
+    WORD_VERDICT_CACHE.clear()
+
+
+@lru_cache()
+def get_abbreviations():
+    return frozenset(entry.strip() for entry in ABBREVIATIONS)
+
+
+@lru_cache()
+def get_slang_words():
+    return frozenset(entry.strip() for entry in SLANG_WORDS)
+
+
+@lru_cache()
+def get_abbreviation_lexicon():
+    extra_entries = [entry for filepath in EXTRA_LEXICON_PATHS for entry in load_lexicon_file(filepath)]
+    return get_abbreviations() | get_slang_words() | frozenset(extra_entries)
 
 
 def is_abbreviation(word):
-    word = str(word)
-    # From 'https://fr.wiktionary.org/wiki/Annexe:Abr%C3%A9viations_en_fran%C3%A7ais'
-    # fmt: off
-    abbreviations = ['1re', '2d', '2de', '1o', '2o', '3o', '7bre', '8bre', '9bre', '10bre', 'A.C.N.', 'ad lib.', 'A.M.', 'ann.', 'app.', 'appt', 'apr.', 'arrt', 'a/s', '℁', 'auj.', 'avc', 'ac', 'BAC', 'B.À.T.', 'b.à.t.', 'bât.', 'bt', 'bcp', 'bd', 'boul.', 'B.P.', 'BTP', 'ca.', 'circa', 'c.-à-d.', 'c.a.d.', 'Cal', 'c. à s.', 'c/s', 'c.c.', 'c/c', 'cc', 'C.C.', 'Cdt', 'cdmt', 'cedex', 'Cel', 'ch.', 'ch.-l.', 'chauff', 'chap.', 'Chr', 'Cie', 'C.N.', 'Cne', 'C.N.S.', 'c/o', 'a/s', '℁', 'contr.', 'C.P.I.', 'cpdt', 'C.Q.F.D', 'crs.', 'C.S.', 'Cte', 'Ctesse', 'dc', 'Dir.', 'dº', 'dito', 'doct.', 'dpdv', 'ds', 'dsl', 'dvlpt', 'dvt', 'ê', 'e. g.', 'e.g.', 'env.', 'et al.', 'cie', 'Éts', 'Ets', 'E.V.', 'exp', 'fact.', 'fasc.', 'féd.', 'fém.', 'févr.', 'FF', 'ff.', 'fg', 'fig.', 'fin.', 'fl.', 'fo', 'fº', 'fol.', 'fos', 'fr.', 'FRF', 'ft', 'fts', 'Gal', 'gd', 'gon', 'hab.', 'HS', 'ibid.', 'id.', 'i. e.', 'id est', 'c.-à-d.', 'inf.', 'Ing.', 'Ir', 'JF', 'JH', 'jms', 'J.O.', 'JO', 'K7', 'l. c.', 'L.D.', 'LL.AA.', 'LL.AA.II.', 'LL.AA.RR.', 'LL.AA.SS.', 'LL.EE.', 'LL.MM.', 'LL.MM.II.RR.', 'LOC', 'loc. cit.', 'Lt', 'méga', 'm̂', 'M.A.', 'Moyen Âge', 'màj', 'm-à-j', 'Mal', 'masc.', 'Md', 'Md', 'm.g.', 'Mgr', 'Mlle', 'Mlles', 'MM.', 'Mmes', 'ms.', 'mtn', 'NA', 'N/A', 'n/a', 'N.B.', 'N.D.', 'N.D.A.', 'N.D.L.R.', 'N.D.T.', 'N.D.W.', 'N.N.', 'NN.SS.', 'Nº', 'nº', 'N.P.A.I.', 'n/réf.', 'ns', 'N.S.', 'op. cit.', 'opt', 'pb', 'p.c.c.', 'pcq', 'p.c.q.', 'P.-D. G.', 'pdt', 'p.ex.', 'p.j.', 'P.J.', 'pk', 'pq', 'pl.', 'plrs', 'pls', 'p/o', 'p.p.', 'Pr', 'P.-S.', 'P.S.', 'pt', 'Pt', 'pt', 'pts', 'pte', 'PTI', 'PV', 'qcq', 'qd', 'QED', 'qq', 'qqch', 'qqf', 'qqf.', 'qqn', 'qqpt', 'qsp', 'qté', 'qté', 'qdm', 'R.T.F.M', 'RTFM', 'R.A.S.', 'R.À.S.', 'rd', 'R.-V.', 'RV', 'rdv', 'REP', 'R.I.P.', 'ro', 'rº', 'RLMI', 'R.P.', 'R. P.', 'RSVP', 's/', 'S.A.', 'S.A.I.', 'S.A.R.', 'S.A.S.', 's/c', 'Sce', 'Sce', 's.d.', 'SDF', 'S.E.', 'Ste', 'Ste', 'sec.', 'sect.', 'SGDG', 'sing.', 's.l.', 'slt', 'S.M.', 'S.M.I.R.', 's/o', 'spec', 'sq.', 'sqq.', 'ss', 's/s', 'SS.', 'Sts', 'Sts', 'ssi', 'Ste', 'Ste', 'Stes', 'Stes', 'S.S.', 'sté', 'Sté', 'stp', 'STP', 'suiv.', 'sup.', 'suppl.', 'svp', 'SVP', 't.', 'tél.', 'téléc.', 'TGV', 'tgv', 'tjrs', 'tjs', 'tlm', 'TPS', 'tq', 'ts', 'TSA', 'T.S.V.P.', 'tt', 'vb.', 'Ve', 'vo', 'vº', 'v/réf', 'vs.', 'V.S.O.P.', 'v .t.', 'Vte', 'Vtesse', 'Vve', 'XL', 'XXL', 'XXXL', 'TTTG', 'X.O.', 'XS', 'TP', 'y c.', 'Z.A.', 'Z.A.C.', 'Z.I.', 'ZUP', 'zup', 'aa', 'ab', 'ac', 'ae', 'af', 'ag', 'aj', 'ak', 'ao', 'ap', 'aq', 'ar', 'aw', 'ax', 'ay', 'az', 'ba', 'bb', 'bc', 'bd', 'bf', 'bg', 'bh']  # noqa
-    # fmt: on
-    return word in abbreviations
+    return str(word) in get_abbreviations()
 
 
 def is_slang(word):
-    word = str(word)
-    # From https://fr.wiktionary.org/wiki/Annexe:Liste_de_termes_d%E2%80%99argot_Internet
-    # fmt: off
-    slang_words = ['@tt', '@tte', 'a tte', 'a12c4', 'a2m1', '2m1', 'abs', 'ac', 'ak', 'aek', 'avc', 'av', 'ajd', 'oj', 'auj', 'ajdh', 'apl', 'a+', '++', '@+', '++++', 'à+', 'ama', 'amha', 'arf', 'erf', 'asv', 'att', 'atta', 'b1', 'bb', 'bp', 'bcp', 'bg', 'bj', 'bjr', 'bsr', 'biz', 'bsx', 'bx', 'bn', 'b8', 'btg', 'bvo', 'c', 'cad', 'càd', 'cbr', 'cc', 'couc', 'chu', 'chuis', 'cki', 'cmr' 'cmer', 'cb', 'cmb', 'ctb', 'ctup', 'cpg', 'pas rave', 'crari', 'ctc', 'dac', 'dacc', 'dak', 'dc', 'dcdr', 'déc-redéc', 'déco-reco', 'dmc', 'dtc', 'dsc', 'dr', 'dsl', 'dtf', 'ect', 'ec', 'ets', 'fd’a', 'fdg', 'fdp', 'ff', 'fpc', 'fr', 'fra', 'ftg', 'gb', 'geta', 'gnih', 'gné', 'gp', 'hg', 'hs', 'hihi', 'htkc', 'jam', 'jdc', 'jdr', 'jdçdr', 'jmef', 'jpp', 'jre', 'je re', 'jrb', 'jta', 'jtad', 'jtdr', 'jtd', 'jtb(f)', 'jtkc', 'jtl(g)', 'jtm', 'j’tm', 'j’t’<3', 'j’tmz', 'jts', 'k.', 'kk', 'kay', 'K7', 'KC', 'kestuf', 'kdo', 'ki', 'kiss', 'kikoo', 'kikou', 'kikoolol', 'klr', 'clr', 'koi', 'kwa', 'koi29', 'koid9', 'lgtmp(s)', 'lgt', 'loule', 'loul', 'lal(e)', 'lold', 'laule', 'lolilol', 'lu', 'lut', 'merki', 'mici', 'mci', 'ci', 'miki', 'mdb', 'mdp', 'mdr', 'mi', 'mm', 'mouaha', 'mouhaha', 'mp', 'mpm', 'ms', 'msg', 'mtnt', 'mnt', 'mwa', 'moa', 'moua', 'ndc', 'nn', 'nan', 'na', 'nop(e)', 'noraj', 'nrv', 'ns', 'nspc', 'ntm', 'nptk', 'oki', 'ololz', 'osef', 'osefdtl', 'osefdts', 'osefdtv', 'oseb', 'ouer', 'ué', 'uè', 'vi', 'mui', 'moui', 'wé', 'woué', 'yep', 'ouep', 'ouè', 'oué', 'oé', 'oè', 'ui', 'wé', 'uep', 'vui', 'voui', 'yup', 'ouai', 'ouais', 'pb', 'pd', 'pde', 'pdt', 'plop', 'pouet', 'poy', 'yop', 'plv', 'ptdr', 'pk', 'pq', 'prq', 'prk', 'pkoi', 'pr', 'psk', 'pck', 'pq', 'pke', 'pcq', 'p-t', 'p-e', 'pê', 'ppda', 'pqtam', 'ptafqm', 'put1', 'pt1', 'tain', "p't", 'ptn', 'pv', 'qq1', 'kk1', 'qqn', 'qqun', 'rab', 'raf', 'ras', 'rav', 'raz', 'razer', 'rb', 'rep', 're reuh', 're-salut', 'rgd', 'roh', 'rtva', 'rtl', 'slt', 'snn', 'spd', 'spj', 'ss', 'j’ss', 'jss', 'st', 'staive', 'srx', 'stoo', 'stp', 'svp', 'talc', 'tdf', 'teuf', 'tfk', 'tftc', 'tg', 'taggle', 'th', 'tgv', 'tjrs', 'tjs', 'tjr', 'tof', 'tkl', 'tkt', 'tlm', 'tllmnt', 'tllmt', 'tmlt', 'tmtc', 'tmts', 'tpm', 'tps', 'tsé', 'tt', 'tte', 'ts', 'ttt', 'twa', 'toa', 'toua', 'toé', 'vg', 'voggle', 'vmk', 'vmvc', 'vmvs', 'vnr', 'vo', 'vost', 'vostfr', 'vtfe', 'vtff', 'vtv', 'vouai', 'mouai', 'vs', 'wi', 'wè', 'wai', 'wé', 'weta', 'xl', 'xlt', 'xdr', 'xpdr', 'xpldr', 'yop', 'zik', '+1', '-1', '*', 'afaik', 'afk', 'aka', 'anw', 'aright', 'asap', 'asc', 'asd', 'asl', 'atfg', 'b', 'bb', 'bbl', 'bbq', 'bbs', 'b/f', 'bf', 'brb', 'bs', 'btw', 'cu ', 'cu2', 'cul', 'cus', 'coz', 'cr', 'cya', 'ded', 'dl', 'ddl', 'del', 'dnftt', 'elf', 'err', 'fb', 'fbc', 'ffs', 'FPS', 'ftl', 'ftf', 'ftw', 'fyi', 'fu', 'fy', 'fwiw', 'g2g', 'geek', 'gf', 'gfy', 'g/f', 'gg', 'giyf', 'gj', 'gl', 'gtg', 'gn8', 'gr8', 'gtfo', 'hf', 'hp', 'hs', 'hth', 'hbtl', 'ianal', 'idk', 'ig', 'iirc', 'igam', 'ily', 'imho', 'imo', 'imy', 'irl', 'iwhbtl', 'iykwim', 'kos', 'lol', 'lo', 'lmao', 'lmfao', 'lol', 'luv', 'l2p', 'mol', 'm2c', 'm8', 'n', 'n1', 'nbd', 'ne1', 'neways', 'nh', 'nk', 'noob', 'naab', 'np', 'nop', 'ns', 'nt', 'nm', 'nm', 'nsfw', 'nvm', 'nw', 'ofc', 'oic', 'omc', 'omg', 'amagad', 'omj', 'omo', 'omfg', 'omw', 'o rly', 'otf', 'otw', 'owj', 'owned ', 'pwnd ', 'etc.', 'p911', 'pix', 'pk', 'plz', 'pol', 'pos', 'pgm', 'pw(d)', 'pwned', 'r', 'rly', 'o rly', 'rdy', 'rfyl', 'rofl', 'rofl', 'rotfl', 'r0fl', 'roflmao', 'rp', "r'pZ", 'rtfm', 'littéralement', 'rtk', 'sec brb', 'sfw', 'Shawol', 'so', 'srsly', 'sry', 'su', 'Ssup', 'STFU', 'STFW', 'sx', 'thx/ty', 'tk', 'tl;dr', 'toycn', 'troll', 'ttyl', 'u', 'up', 'usa', 'ur', 'Wassup', 'w8', 'wb', 'woot', 'wp', 'wtf', 'wtfg', 'wtg', 'wth', 'wtj', 'wuup2', 'y', 'ya rly', 'yafa', 'ygam', 'ymmv', 'yw', 'acias', 'ara', 'dsps', 'iwal', 'jaja', 'jeje', 'jiji', 'jojo', 'jd', 'kerer', 'mñn', 'muxo', 'pq', 'pk', "qva!", 'ta', 'tb', 'tp', 'tqp', 'weno', 'güeno', 'x', 'xuxa', 'a+', 'asv', 'bcp', 'dsl', 'lol', 'mdr', 'ptdr', 'rotfl', 'slt', 'tlm', '+1', 'plop', 're']  # noqa
-    # fmt: on
-    return word in slang_words
+    return str(word) in get_slang_words()
+
+
+@requires('text')
+def is_abbreviation_or_slang(word):
+    return str(word) in get_abbreviation_lexicon()
+
+
+@lru_cache()
+def get_abbreviation_matcher():
+    # Entries with punctuation or spaces (e.g. 'et al.', 'c.-à-d.', 'Moyen Âge') can span several tokens
+    return AhoCorasick([entry for entry in get_abbreviation_lexicon() if not entry.isalnum()])
+
+
+def get_multi_token_abbreviation_detections(doc, detections=None):
+    '''Detect the lexicon entries spanning several tokens, single tokens are handled by `is_abbreviation_or_slang`.'''
+    if detections is None:
+        detections = Detections(doc.text)
+    token_spans = {(token.idx, token.idx + len(str(token))) for token in doc}
+    token_starts = {start for start, _ in token_spans}
+    token_ends = {end for _, end in token_spans}
+    matches = [
+        (start, end)
+        for start, end in get_abbreviation_matcher().iter_matches(doc.text)
+        if start in token_starts and end in token_ends and (start, end) not in token_spans
+    ]
+    for start, end in get_leftmost_longest_matches(matches):
+        detections.append(start, end - start, ABBREVIATION_DETECTOR)
+    return detections
 
 
 def remove_punctuation_characters(word):
-    punctuation = string.punctuation + '’' + '\n'
-    return ''.join([char for char in word if char not in punctuation])
+    return ''.join([char for char in word if char not in PUNCTUATION_CHARACTERS])
 
 
 def is_time(word):
-    return re.match(r'\d+[hH:]\d*', word) is not None
+    return TIME_REGEX.match(word) is not None
 
 
 def skip_word_detection(token):
@@ -143,6 +345,10 @@ def skip_word_detection(token):
     return False
 
 
+ABBREVIATION_DETECTOR = 'Abbréviation'
+LONG_SENTENCE_DETECTOR = 'Phrase Longue'
+
+
 def get_word_detectors():
     return {
         # Some detectors need to take the lemma as input, other need to take the word exactly as it is written.
@@ -150,11 +356,85 @@ def get_word_detectors():
         'Majuscules': is_frequent_word_written_in_capitals,
         'Emprunt Anglais': is_english_word,
         'Accronyme': is_accronym,
-        'Abbréviation': lambda word: is_abbreviation(word) or is_slang(word),
+        ABBREVIATION_DETECTOR: is_abbreviation_or_slang,
         'Nombre': is_number,
     }
 
 
+class TokenBatch:
+    '''Texts and lemmas of the tokens of a batch, passed to the vectorized detectors.
+
+    Ranks are looked up once per distinct word and rank table for the whole batch, and the detector results are kept
+    so that a detector reusing another one (Accronyme uses Majuscules) does not compute it again.
+    '''
+
+    def __init__(self, texts, lemmas):
+        self.texts = texts
+        self.lemmas = lemmas
+        self._word2rank = {}  # (vocab_size, language, training_corpus) -> {word: rank} of the words looked up
+        self._results = {}
+
+    def get_ranks(self, words, vocab_size=DEFAULT_VOCAB_SIZE, language='fr', training_corpus='common_crawl'):
+        '''Same as `get_ranks` for words of this batch.'''
+        import numpy as np
+
+        word2rank = self._word2rank.setdefault((vocab_size, language, training_corpus), {})
+        unseen_words = list({word for word in words if word not in word2rank})
+        if len(unseen_words) > 0:
+            ranks = get_word2rank(vocab_size, language, training_corpus).get_many(unseen_words, default=float('inf'))
+            word2rank.update(zip(unseen_words, ranks))
+        return np.fromiter((word2rank[word] for word in words), dtype=float, count=len(words))
+
+    def get_result(self, vectorized_detector):
+        if vectorized_detector not in self._results:
+            self._results[vectorized_detector] = vectorized_detector(self)
+        return self._results[vectorized_detector]
+
+
+# Vectorized versions of the rank based detectors, they take a `TokenBatch` and return boolean arrays matching the per
+# token detectors exactly. Tokens that the per token detector rejects before looking up their rank are not looked up.
+def is_rare_word_batch(batch, rank_threshold=3500, vocab_size=DEFAULT_VOCAB_SIZE):
+    import numpy as np
+
+    is_rare = np.zeros(len(batch.lemmas), dtype=bool)
+    indexes = [i for i, lemma in enumerate(batch.lemmas) if not is_number(lemma)]
+    ranks = batch.get_ranks([batch.lemmas[i].lower() for i in indexes], vocab_size=vocab_size)
+    is_rare[indexes] = ranks > rank_threshold
+    return is_rare
+
+
+def is_frequent_word_written_in_capitals_batch(batch, rank_threshold=50000, language='fr', **kwargs):
+    import numpy as np
+
+    is_frequent_in_capitals = np.zeros(len(batch.texts), dtype=bool)
+    indexes = [i for i, text in enumerate(batch.texts) if is_written_in_capitals(text)]
+    ranks = batch.get_ranks([batch.texts[i].lower() for i in indexes], language=language, **kwargs)
+    is_frequent_in_capitals[indexes] = ranks < rank_threshold
+    return is_frequent_in_capitals
+
+
+def is_english_word_batch(
+    batch, rank_ratio=5, fr_rank_threshold=15000, en_rank_threshold=5000, vocab_size=DEFAULT_VOCAB_SIZE
+):
+    fr_ranks = batch.get_ranks(batch.lemmas, language='fr', vocab_size=vocab_size)
+    en_ranks = batch.get_ranks(batch.lemmas, language='en', vocab_size=vocab_size)
+    return (fr_ranks > rank_ratio * en_ranks) | ((fr_ranks > fr_rank_threshold) & (en_ranks < en_rank_threshold))
+
+
+def is_accronym_batch(batch):
+    matches_regex = _to_bool_array([ACCRONYM_REGEX.match(text) is not None for text in batch.texts])
+    return matches_regex & ~batch.get_result(is_frequent_word_written_in_capitals_batch)
+
+
+def get_vectorized_word_detectors():
+    return {
+        'Rare': is_rare_word_batch,
+        'Majuscules': is_frequent_word_written_in_capitals_batch,
+        'Emprunt Anglais': is_english_word_batch,
+        'Accronyme': is_accronym_batch,
+    }
+
+
 def run_detectors(text):
     text = clean_text(text)
     detector_results = {}
@@ -185,15 +465,373 @@ def get_long_sentences(text, threshold=11, count_method=count_content_tokens):
     return [sentence for sentence in sentences if count_method(sentence) > threshold]
 
 
-def get_detections(text):
-    detections = []
-    for token in spacy_process(text, language='fr'):
-        detector_results = []
-        if not skip_word_detection(token):
-            detected_types = [name for name, detector in get_word_detectors().items() if detector(token)]
-            for detected_type in detected_types:
-                detections.append({'text': str(token), 'char_offset': token.idx, 'detected_type': detected_type})
+def get_detection_requirements(detectors=None):
+    '''Token attributes needed to run the given detectors (all detectors by default).'''
+    if detectors is None:
+        detectors = get_detector_names()
+    requirements = set()
+    for name in detectors:
+        if name == LONG_SENTENCE_DETECTOR:
+            continue  # Sentences are split with NLTK on the raw text
+        requirements |= get_word_detectors()[name].requirements
+    return requirements
+
+
+def get_detector_names():
+    return list(get_word_detectors()) + [LONG_SENTENCE_DETECTOR]
+
+
+def get_lexical_detector_names():
+    '''Detectors that only need the token text, they run with the tokenizer only.'''
+    return [name for name in get_detector_names() if get_detection_requirements([name]) <= {'text'}]
+
+
+# Detected types of each (surface form, lemma, detector names), shared across documents since most tokens repeat
+WORD_VERDICT_CACHE = LRUCache(maxsize=10 ** 6)
+
+
+def get_word_verdict_cache_stats():
+    return WORD_VERDICT_CACHE.get_stats()
+
+
+def get_detected_types(token, word_detectors):
+    if skip_word_detection(token):
+        return ()
+    return tuple(name for name, detector in word_detectors.items() if detector(token))
+
+
+def get_detected_types_batch(tokens, word_detectors):
+    '''Same as `get_detected_types` on a list of tokens, rank based detectors are evaluated on all tokens at once.'''
+    detected_types = [() for _ in tokens]
+    indexes = [i for i, token in enumerate(tokens) if not skip_word_detection(token)]
+    tokens = [tokens[i] for i in indexes]
+    batch = TokenBatch([str(token) for token in tokens], [str(cast_to_lemma_if_possible(token)) for token in tokens])
+    vectorized_word_detectors = get_vectorized_word_detectors()
+    columns = []
+    for name, detector in word_detectors.items():
+        with profile_stage(f'detector.{name}'):
+            if name in vectorized_word_detectors:
+                columns.append(batch.get_result(vectorized_word_detectors[name]).tolist())
+            else:
+                columns.append([detector(token) for token in tokens])
+    names = list(word_detectors)
+    for i, is_detected_row in zip(indexes, zip(*columns)):
+        detected_types[i] = tuple(name for name, is_detected in zip(names, is_detected_row) if is_detected)
+    return detected_types
+
+
+def get_word_detections(doc, detectors=None, detections=None):
+    '''Detections of the single token detectors, appended to `detections` when given.'''
+    if detections is None:
+        detections = Detections(doc.text)
+    word_detectors = get_word_detectors()
+    if detectors is not None:
+        word_detectors = {name: detector for name, detector in word_detectors.items() if name in detectors}
+    detector_names = tuple(word_detectors)
+    keys = [(str(token), token.lemma_, detector_names) for token in doc]
+    # Look up the verdicts of all tokens first, then run the detectors on the unseen tokens in a single batch
+    key_to_detected_types = {}
+    key_to_unseen_token = {}
+    for key, token in zip(keys, doc):
+        if key in key_to_detected_types or key in key_to_unseen_token:
+            continue
+        detected_types = WORD_VERDICT_CACHE.get(key)
+        if detected_types is None:
+            key_to_unseen_token[key] = token
+        else:
+            key_to_detected_types[key] = detected_types
+    unseen_detected_types = get_detected_types_batch(list(key_to_unseen_token.values()), word_detectors)
+    for key, detected_types in zip(key_to_unseen_token, unseen_detected_types):
+        WORD_VERDICT_CACHE.put(key, detected_types)
+        key_to_detected_types[key] = detected_types
+    for key, token in zip(keys, doc):
+        for detected_type in key_to_detected_types[key]:
+            detections.append(token.idx, len(key[0]), detected_type)
+    return detections
+
+
+def get_long_sentence_spans(doc, threshold=11):
+    '''Character spans of the sentences with more than `threshold` content tokens.
+
+    Sentences are split with NLTK and their content tokens are counted in a single pass over the tokens of the already
+    processed doc, aligned on the sentence spans by character offset.
+    '''
+    sentence_spans = get_sentence_spans(doc.text, language='fr')
+    counts = count_content_tokens_in_spans(doc, sentence_spans, language='fr')
+    return [span for span, count in zip(sentence_spans, counts) if count > threshold]
 
-    for sentence in get_long_sentences(text):
-        detections.append({'text': sentence, 'char_offset': text.index(sentence), 'detected_type': 'Phrase Longue'})
+
+def get_long_sentence_detections(doc, threshold=11, detections=None):
+    if detections is None:
+        detections = Detections(doc.text)
+    for start, end in get_long_sentence_spans(doc, threshold=threshold):
+        detections.append(start, end - start, LONG_SENTENCE_DETECTOR)
+    return detections
+
+
+def _get_detections_from_doc(doc, detectors=None):
+    detections = get_word_detections(doc, detectors=detectors)
+    if detectors is None or ABBREVIATION_DETECTOR in detectors:
+        with profile_stage(f'detector.{ABBREVIATION_DETECTOR}.multi_token'):
+            get_multi_token_abbreviation_detections(doc, detections=detections)
+    if detectors is None or LONG_SENTENCE_DETECTOR in detectors:
+        with profile_stage(f'detector.{LONG_SENTENCE_DETECTOR}'):
+            get_long_sentence_detections(doc, detections=detections)
     return detections
+
+
+def save_snapshot(languages=('fr',)):
+    '''Save the pipelines, punkt models and rank indexes locally so that later processes start without network calls.'''
+    for language in languages:
+        save_spacy_model_snapshot(language=language)
+        save_nltk_sentence_tokenizer_snapshot(language=language)
+    load_word_detector_resources()  # Builds the rank indexes if needed
+
+
+def get_cache_stats():
+    word2rank_cache_info = get_word2rank.cache_info()
+    return {
+        'spacy_doc': get_spacy_doc_cache_stats(),
+        'word_verdict': get_word_verdict_cache_stats(),
+        'word2rank': {'hits': word2rank_cache_info.hits, 'misses': word2rank_cache_info.misses},
+        'persistent_detection': {'hits': 0, 'misses': 0}
+        if PERSISTENT_DETECTION_CACHE is None
+        else PERSISTENT_DETECTION_CACHE.get_stats(),
+    }
+
+
+def get_prometheus_metrics():
+    '''Stage timings recorded since `enable_profiling()` and cache counters, in the Prometheus text format.'''
+    return format_prometheus(GLOBAL_PROFILER, get_cache_stats())
+
+
+PERSISTENT_DETECTION_CACHE = None
+
+
+def enable_persistent_detection_cache(path=RESOURCES_DIR / 'detections_cache.sqlite', max_bytes=1024 ** 3):
+    '''Store the detections on disk, so that they are reused across processes and restarts.
+
+    Entries are keyed by the text and a fingerprint of the configuration (detectors, thresholds, spaCy model, rank
+    indexes and lexicons), so changing any of them invalidates the previous entries, which are eventually evicted.
+    '''
+    global PERSISTENT_DETECTION_CACHE
+    PERSISTENT_DETECTION_CACHE = SQLiteCache(path, max_bytes=max_bytes)
+
+
+def disable_persistent_detection_cache():
+    global PERSISTENT_DETECTION_CACHE
+    PERSISTENT_DETECTION_CACHE = None
+
+
+def get_default_arguments(function):
+    # Inline lazy import because importing inspect is slow
+    import inspect
+
+    return {
+        name: parameter.default
+        for name, parameter in inspect.signature(function).parameters.items()
+        if parameter.default is not inspect.Parameter.empty
+    }
+
+
+def get_file_fingerprint(filepath):
+    stat = Path(filepath).stat()
+    return [str(filepath), stat.st_size, stat.st_mtime_ns]
+
+
+def get_detection_config(detectors=None):
+    spacy_model = get_spacy_model(language='fr')
+    detector_functions = {**get_word_detectors(), **get_vectorized_word_detectors()}.values()
+    return {
+        'detectors': sorted(get_detector_names() if detectors is None else detectors),
+        'thresholds': {
+            function.__name__: get_default_arguments(function)
+            for function in [*detector_functions, get_long_sentence_spans, count_content_tokens_in_spans]
+        },
+        'spacy_model': {key: spacy_model.meta.get(key) for key in ['lang', 'name', 'version']},
+        'spacy_pipes': spacy_model.pipe_names,
+        # Digest of the words ranked below DEFAULT_VOCAB_SIZE, the same for a larger index of the same vocabulary
+        'rank_indexes': [get_rank_table(language=language).digest for language in ['fr', 'en']],
+        'lexicons': [get_file_fingerprint(filepath) for filepath in EXTRA_LEXICON_PATHS],
+        'result_format': 'columns',
+    }
+
+
+@lru_cache()
+def _get_detection_config_fingerprint(detectors=None):
+    config = get_detection_config(detectors)
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+
+def get_persistent_cache_key(text, detectors=None):
+    fingerprint = _get_detection_config_fingerprint(None if detectors is None else tuple(detectors))
+    return hashlib.sha256(f'{fingerprint}\0{text}'.encode('utf8', 'surrogatepass')).hexdigest()
+
+
+def get_compact_detections(text, detectors=None):
+    '''Same as `get_detections` but returns a `Detections` object (parallel arrays referencing the text).'''
+    if PERSISTENT_DETECTION_CACHE is not None:
+        key = get_persistent_cache_key(text, detectors)
+        columns = PERSISTENT_DETECTION_CACHE.get(key)
+        if columns is not None:
+            return Detections.from_columns(str(text), columns)
+    disable = get_disabled_pipes(get_detection_requirements(detectors), language='fr')
+    with profile_stage('spacy_process'):
+        doc = spacy_process(text, disable=disable, language='fr')
+    detections = _get_detections_from_doc(doc, detectors=detectors)
+    if PERSISTENT_DETECTION_CACHE is not None:
+        PERSISTENT_DETECTION_CACHE.put(key, detections.to_columns())
+    return detections
+
+
+def get_detections(text, detectors=None, profile=False):
+    '''Run the given detectors (names from `get_detector_names()`, all by default) on the text.
+
+    Only the spaCy components needed by the detectors are run: MElt and Lefff never run since the detectors read spaCy's
+    lemmas, and e.g. `detectors=get_lexical_detector_names()` only runs the tokenizer.
+    With `profile=True`, returns a (detections, report) tuple where the report contains the wall time and number of
+    calls of each pipeline stage and detector, and the cache hits and misses during the call.
+    '''
+    if not profile:
+        return get_compact_detections(text, detectors=detectors).to_dicts()
+    cache_stats_before = get_cache_stats()
+    with record() as profiler:
+        with profile_stage('total'):
+            detections = get_compact_detections(text, detectors=detectors).to_dicts()
+    cache_stats_after = get_cache_stats()
+    report = {
+        'stages': profiler.get_report(),
+        'caches': {
+            cache_name: {
+                counter: cache_stats_after[cache_name][counter] - cache_stats_before[cache_name][counter]
+                for counter in ['hits', 'misses']
+            }
+            for cache_name in cache_stats_after
+        },
+    }
+    return detections, report
+
+
+def load_word_detector_resources():
+    # Load the rank indexes before the detection workers are forked so that they share the same memory-mapped pages
+    get_word2rank(language='fr').get('')
+    get_word2rank(language='en').get('')
+
+
+def get_detections_batch(texts, n_process=1, batch_size=32, detectors=None, compact=False):
+    '''Yield the detections of each text of `texts` (any iterable), in input order.
+
+    Texts are streamed through spaCy's `nlp.pipe` by batches of `batch_size`. With `n_process > 1`, each batch is
+    processed by one of `n_process` worker processes, spaCy and the detectors included, and only the compact
+    detections are sent back. With `compact=True`, `Detections` objects are yielded instead of lists of dicts.
+    '''
+    for detections in _yield_compact_detections_batch(texts, n_process, batch_size, detectors):
+        yield detections if compact else detections.to_dicts()
+
+
+def _load_detection_resources(detectors=None):
+    get_disabled_pipes(get_detection_requirements(detectors), language='fr')  # Loads the spaCy pipeline
+    if detectors is None or LONG_SENTENCE_DETECTOR in detectors:
+        get_nltk_sentence_tokenizer(language='fr')
+    load_word_detector_resources()
+
+
+def _get_detections_chunk(texts, detectors=None):
+    # Run in the worker processes of `_yield_detections`
+    disable = get_disabled_pipes(get_detection_requirements(detectors), language='fr')
+    detections_chunk = []
+    for doc in spacy_pipe(texts, batch_size=len(texts), disable=disable, language='fr'):
+        detections = _get_detections_from_doc(doc, detectors=detectors)
+        detections.text = None  # The parent process already has the text
+        detections_chunk.append(detections)
+    return detections_chunk
+
+
+def _yield_detections(texts, n_process=1, batch_size=32, detectors=None):
+    texts = (str(text) for text in texts)
+    if n_process == 1:
+        disable = get_disabled_pipes(get_detection_requirements(detectors), language='fr')
+        for doc in spacy_pipe(texts, batch_size=batch_size, disable=disable, language='fr'):
+            yield _get_detections_from_doc(doc, detectors=detectors)
+        return
+    # Inline lazy import because importing concurrent.futures is slow
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Loaded before forking so that the workers inherit the models and share the rank indexes
+    _load_detection_resources(detectors)
+    with ProcessPoolExecutor(
+        max_workers=n_process, initializer=_load_detection_resources, initargs=(detectors,)
+    ) as executor:
+        futures = deque()  # (texts, future) of the chunks submitted but not yielded yet
+
+        def yield_chunk_detections(texts, future):
+            for text, detections in zip(texts, future.result()):
+                detections.text = text
+                yield detections
+
+        while True:
+            chunk = list(islice(texts, batch_size))
+            if len(chunk) == 0:
+                break
+            futures.append((chunk, executor.submit(_get_detections_chunk, chunk, detectors)))
+            if len(futures) >= 2 * n_process:  # Bound the number of texts read ahead
+                yield from yield_chunk_detections(*futures.popleft())
+        while len(futures) > 0:
+            yield from yield_chunk_detections(*futures.popleft())
+
+
+def _yield_compact_detections_batch(texts, n_process=1, batch_size=32, detectors=None):
+    load_word_detector_resources()
+    if PERSISTENT_DETECTION_CACHE is None:
+        yield from _yield_detections(texts, n_process=n_process, batch_size=batch_size, detectors=detectors)
+        return
+    # Only the texts missing from the persistent cache go through the pipeline, results are yielded in input order
+    pending = deque()  # (key, cached detections or None) of the texts read but not yielded yet
+
+    def yield_uncached_texts():
+        for text in texts:
+            text = str(text)
+            key = get_persistent_cache_key(text, detectors)
+            columns = PERSISTENT_DETECTION_CACHE.get(key)
+            pending.append((key, None if columns is None else Detections.from_columns(text, columns)))
+            if columns is None:
+                yield text
+
+    for detections in _yield_detections(
+        yield_uncached_texts(), n_process=n_process, batch_size=batch_size, detectors=detectors
+    ):
+        while pending[0][1] is not None:
+            yield pending.popleft()[1]
+        key, _ = pending.popleft()
+        PERSISTENT_DETECTION_CACHE.put(key, detections.to_columns())
+        yield detections
+    while len(pending) > 0:
+        yield pending.popleft()[1]
+
+
+def get_detections_threaded(texts, n_threads=4, detectors=None, thread_local_models=False, compact=False):
+    '''Yield the detections of each text of `texts` (any iterable), in input order, computed in `n_threads` threads.
+
+    `get_detections` can be called from any thread: the models and rank indexes are shared read-only and the caches
+    are thread-safe. With `thread_local_models=True`, each thread loads its own spaCy pipeline (more memory, nothing
+    shared). The speedup depends on how much of the pipeline releases the GIL, `get_detections_batch` with several
+    processes is better suited to offline batches. With `compact=True`, `Detections` objects are yielded.
+    '''
+    # Inline lazy import because importing concurrent.futures is slow
+    from concurrent.futures import ThreadPoolExecutor
+
+    load_word_detector_resources()
+    initializer = use_thread_local_spacy_models if thread_local_models else None
+
+    def yield_compact_detections():
+        with ThreadPoolExecutor(max_workers=n_threads, initializer=initializer) as executor:
+            futures = deque()
+            for text in texts:
+                futures.append(executor.submit(get_compact_detections, text, detectors=detectors))
+                if len(futures) >= 2 * n_threads:  # Bound the number of texts read ahead
+                    yield futures.popleft().result()
+            while len(futures) > 0:
+                yield futures.popleft().result()
+
+    for detections in yield_compact_detections():
+        yield detections if compact else detections.to_dicts()
@@ -0,0 +1,305 @@
+'''Resumable, parallel and checksum-verified download of the resources (fastText embeddings, models).
+
+`fetch` downloads a file with several HTTP range requests in parallel into `<destination>.partial`, the progress of
+each range is saved in `<destination>.partial.json` so that an interrupted download resumes where it stopped.
+`fetch_and_extract` decompresses .gz, .bz2 and .tar.* archives while they are read, straight to the final path, .zip
+archives (which need random access) are fetched first then extracted.
+
+Before hitting the network, files are looked up by name in the local mirror directories (`mirror_dirs`, by default the
+`CAPFALCNLP_MIRROR_DIRS` environment variable, separated by `os.pathsep`) so that air-gapped machines can be
+provisioned by copying the files, and in `cache_dir` where downloaded archives are kept when given.
+'''
+import bz2
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+
+
+MIRROR_DIRS = [Path(path) for path in os.environ.get('CAPFALCNLP_MIRROR_DIRS', '').split(os.pathsep) if path != '']
+BLOCK_SIZE = 1024 ** 2
+ARCHIVE_EXTENSIONS = ['.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.tar', '.zip', '.gz', '.bz2']
+
+
+def get_filename(url):
+    return url.split('?')[0].split('/')[-1]
+
+
+def get_mirror_path(url, mirror_dirs=None):
+    '''Local copy of the file at `url` in one of the mirror directories, None if there is none.'''
+    if mirror_dirs is None:
+        mirror_dirs = MIRROR_DIRS
+    for mirror_dir in mirror_dirs:
+        mirror_path = Path(mirror_dir) / get_filename(url)
+        if mirror_path.exists():
+            return mirror_path
+    return None
+
+
+def get_file_sha256(filepath):
+    file_hash = hashlib.sha256()
+    with Path(filepath).open('rb') as f:
+        for data in iter(lambda: f.read(BLOCK_SIZE), b''):
+            file_hash.update(data)
+    return file_hash.hexdigest()
+
+
+def check_sha256(actual_sha256, expected_sha256, name):
+    if expected_sha256 is not None and actual_sha256 != expected_sha256.lower():
+        raise ValueError(f'Checksum mismatch for {name}: expected sha256 {expected_sha256}, got {actual_sha256}')
+
+
+def get_remote_file_info(url, timeout=30):
+    '''(size, supports_ranges) of the remote file, size is None when unknown.'''
+    from urllib.request import Request, urlopen
+
+    # A one byte range request tells both the size and whether ranges are supported, HEAD is not always allowed
+    with urlopen(Request(url, headers={'Range': 'bytes=0-0'}), timeout=timeout) as response:
+        if response.status == 206:
+            return int(response.headers['Content-Range'].split('/')[-1]), True
+        content_length = response.headers.get('Content-Length')
+        return (int(content_length) if content_length is not None else None), False
+
+
+def get_ranges(size, n_connections, min_range_size=BLOCK_SIZE):
+    range_size = max(-(-size // n_connections), min_range_size)
+    return [(start, min(start + range_size, size)) for start in range(0, size, range_size)]
+
+
+class _DownloadProgress:
+    '''Number of bytes downloaded in each range, saved to a JSON file to resume interrupted downloads.'''
+
+    def __init__(self, progress_path, url, size, ranges, resume=True):
+        self.progress_path = progress_path
+        self.lock = threading.Lock()
+        self.state = {'url': url, 'size': size, 'done': {f'{start}-{end}': 0 for start, end in ranges}}
+        if resume and progress_path.exists():
+            previous_state = json.loads(progress_path.read_text())
+            if (previous_state['url'], previous_state['size']) == (url, size):
+                self.state = previous_state
+
+    def get_ranges(self):
+        return [tuple(int(offset) for offset in key.split('-')) for key in self.state['done']]
+
+    def get_done(self, start, end):
+        with self.lock:
+            return self.state['done'][f'{start}-{end}']
+
+    def add(self, start, end, n_bytes):
+        with self.lock:
+            self.state['done'][f'{start}-{end}'] += n_bytes
+
+    def get_n_bytes_done(self):
+        with self.lock:
+            return sum(self.state['done'].values())
+
+    def save(self):
+        with self.lock:
+            content = json.dumps(self.state)
+        tmp_path = self.progress_path.with_name(self.progress_path.name + '.tmp')
+        tmp_path.write_text(content)
+        os.replace(tmp_path, self.progress_path)
+
+
+def _download_range(url, partial_path, start, end, progress, timeout):
+    from urllib.request import Request, urlopen
+
+    offset = start + progress.get_done(start, end)
+    if offset >= end:
+        return
+    with urlopen(Request(url, headers={'Range': f'bytes={offset}-{end - 1}'}), timeout=timeout) as response:
+        if response.status != 206:
+            raise IOError(f'{url} did not answer the range request with a partial content')
+        with partial_path.open('r+b') as f:
+            f.seek(offset)
+            while offset < end:
+                data = response.read(min(BLOCK_SIZE, end - offset))
+                if data == b'':
+                    raise IOError(f'Connection closed before the end of range {start}-{end} of {url}')
+                f.write(data)
+                f.flush()  # Written before being counted as done, so a resumed download never skips missing bytes
+                offset += len(data)
+                progress.add(start, end, len(data))
+
+
+def _download_single_stream(url, partial_path, timeout):
+    from urllib.request import urlopen
+
+    with urlopen(url, timeout=timeout) as response, partial_path.open('wb') as f:
+        shutil.copyfileobj(response, f, BLOCK_SIZE)
+
+
+def _print_progress(n_bytes_done, size, start_time):
+    duration = max(time.time() - start_time, 1e-6)
+    progress_size_mb = n_bytes_done / 1024 ** 2
+    percent = int(n_bytes_done * 100 / size) if size else 0
+    sys.stdout.write(f'\r... {percent}% - {int(progress_size_mb)} MB - {progress_size_mb / duration:.2f} MB/s')
+
+
+def fetch(url, destination_path, sha256=None, n_connections=4, mirror_dirs=None, timeout=30, verbose=True):
+    '''Download `url` to `destination_path` (skipped if it exists), checking its sha256 when given.'''
+    destination_path = Path(destination_path)
+    if destination_path.exists():
+        return destination_path
+    destination_path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = destination_path.with_name(destination_path.name + '.partial')
+    progress_path = destination_path.with_name(destination_path.name + '.partial.json')
+    mirror_path = get_mirror_path(url, mirror_dirs)
+    if mirror_path is not None:
+        shutil.copyfile(mirror_path, partial_path)
+    else:
+        size, supports_ranges = get_remote_file_info(url, timeout=timeout)
+        if not supports_ranges or size is None or size == 0:
+            # No resume possible, the download starts over
+            _download_single_stream(url, partial_path, timeout)
+        else:
+            resume = partial_path.exists() and partial_path.stat().st_size == size
+            progress = _DownloadProgress(progress_path, url, size, get_ranges(size, n_connections), resume=resume)
+            if not resume:
+                with partial_path.open('wb') as f:
+                    f.truncate(size)
+            start_time = time.time()
+            try:
+                with ThreadPoolExecutor(max_workers=n_connections) as executor:
+                    futures = [
+                        executor.submit(_download_range, url, partial_path, start, end, progress, timeout)
+                        for start, end in progress.get_ranges()
+                    ]
+                    while True:
+                        done, not_done = wait(futures, timeout=1, return_when=FIRST_EXCEPTION)
+                        progress.save()
+                        if verbose:
+                            _print_progress(progress.get_n_bytes_done(), size, start_time)
+                        if len(not_done) == 0 or any(future.exception() is not None for future in done):
+                            break
+            finally:
+                # Saved once the executor has waited for all the ranges, including those finishing after an error
+                progress.save()
+                if verbose:
+                    sys.stdout.write('\n')
+            for future in futures:
+                future.result()  # Raises the first error, the partial file is kept to resume later
+    try:
+        check_sha256(get_file_sha256(partial_path), sha256, url)
+    except ValueError:
+        partial_path.unlink()
+        if progress_path.exists():
+            progress_path.unlink()
+        raise
+    os.replace(partial_path, destination_path)
+    if progress_path.exists():
+        progress_path.unlink()
+    return destination_path
+
+
+class _HashingReader:
+    '''File object wrapper computing the sha256 of the bytes read.'''
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hash.update(data)
+        return data
+
+    def read_to_end(self):
+        for _ in iter(lambda: self.read(BLOCK_SIZE), b''):
+            pass
+        return self.hash.hexdigest()
+
+
+def get_archive_extension(filename):
+    # The longest matching extension (.tar.gz takes precedence over .gz)
+    extensions = [extension for extension in ARCHIVE_EXTENSIONS if filename.endswith(extension)]
+    if len(extensions) == 0:
+        raise NotImplementedError(f'Can not extract {filename}, supported extensions are {ARCHIVE_EXTENSIONS}')
+    return max(extensions, key=len)
+
+
+def _extract_tar_stream(fileobj, output_dir):
+    with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+        for member in tar:
+            member_path = (output_dir / member.name).resolve()
+            if member_path != output_dir.resolve() and output_dir.resolve() not in member_path.parents:
+                raise ValueError(f'Archive member {member.name} would be extracted outside of {output_dir}')
+            tar.extract(member, output_dir)
+
+
+def _extract_stream(fileobj, extension, partial_path):
+    if extension in ['.gz', '.bz2']:
+        decompressed_file = gzip.GzipFile(fileobj=fileobj, mode='rb') if extension == '.gz' else bz2.BZ2File(fileobj)
+        with decompressed_file, partial_path.open('wb') as f:
+            shutil.copyfileobj(decompressed_file, f, BLOCK_SIZE)
+    else:
+        partial_path.mkdir()
+        _extract_tar_stream(fileobj, partial_path)
+
+
+def remove_path(path):
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+def fetch_and_extract(
+    url, destination_path, sha256=None, n_connections=4, mirror_dirs=None, cache_dir=None, timeout=30, verbose=True
+):
+    '''Download and extract an archive to `destination_path` (skipped if it exists), checking its sha256 when given.
+
+    `destination_path` is the decompressed file for .gz and .bz2 archives and a directory for .tar.* and .zip archives.
+    Without a mirror nor a `cache_dir`, the archive is decompressed while it is downloaded and never written to disk.
+    With `cache_dir`, the archive is downloaded there first (resumable, in parallel) and kept for later fetches.
+    '''
+    from urllib.request import urlopen
+
+    destination_path = Path(destination_path)
+    if destination_path.exists():
+        return destination_path
+    destination_path.parent.mkdir(parents=True, exist_ok=True)
+    extension = get_archive_extension(get_filename(url))
+    if mirror_dirs is None:
+        mirror_dirs = MIRROR_DIRS
+    archive_path = get_mirror_path(url, [*mirror_dirs, *([cache_dir] if cache_dir is not None else [])])
+    remove_archive = False
+    if archive_path is None and (cache_dir is not None or extension == '.zip'):
+        # Zip archives need random access, without cache dir they are downloaded next to the destination then removed
+        remove_archive = cache_dir is None
+        archive_dir = Path(cache_dir) if cache_dir is not None else destination_path.parent
+        archive_path = archive_dir / get_filename(url)
+        fetch(url, archive_path, sha256, n_connections, mirror_dirs=[], timeout=timeout, verbose=verbose)
+        sha256 = None  # Already checked by fetch
+    partial_path = destination_path.with_name(destination_path.name + '.partial')
+    remove_path(partial_path)
+    if verbose:
+        print(f'Extracting {get_filename(url)} to {destination_path}...')
+    try:
+        if extension == '.zip':
+            with zipfile.ZipFile(archive_path) as archive:
+                archive.extractall(partial_path)  # zipfile sanitizes the member paths
+            actual_sha256 = get_file_sha256(archive_path) if sha256 is not None else None
+        else:
+            source = archive_path.open('rb') if archive_path is not None else urlopen(url, timeout=timeout)
+            with source:
+                hashing_reader = _HashingReader(source)
+                _extract_stream(hashing_reader, extension, partial_path)
+                actual_sha256 = hashing_reader.read_to_end()  # Archives can have trailing bytes
+        check_sha256(actual_sha256, sha256, url)
+    except BaseException:
+        remove_path(partial_path)
+        raise
+    finally:
+        if remove_archive:
+            archive_path.unlink()
+    os.replace(partial_path, destination_path)
+    return destination_path
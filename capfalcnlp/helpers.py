@@ -1,7 +1,8 @@
 import bz2
+import codecs
 from contextlib import contextmanager
 import gzip
-from io import StringIO
+import io
 import os
 from pathlib import Path
 import re
@@ -9,13 +10,11 @@ import shutil
 import sys
 import tarfile
 import tempfile
+import threading
 import time
 from types import MethodType
-from urllib.request import urlretrieve
 import zipfile
 
-from tqdm import tqdm
-
 
 @contextmanager
 def redirect_streams(source_streams, target_streams):
@@ -47,15 +46,52 @@ def redirect_streams(source_streams, target_streams):
             source_stream.flush = original_source_stream_flush
 
 
+class _ThreadMutableStream:
+    '''Proxy of a standard stream that drops the writes of the threads currently inside `mute()`.'''
+
+    def __init__(self, stream, name):
+        self._stream = stream
+        self._name = name
+
+    def write(self, message):
+        if getattr(_MUTED_THREADS, self._name, 0) > 0:
+            return len(message)
+        return self._stream.write(message)
+
+    def flush(self):
+        if getattr(_MUTED_THREADS, self._name, 0) > 0:
+            return
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+_MUTED_THREADS = threading.local()  # Stream name -> mute depth of the current thread
+_STREAM_PROXY_LOCK = threading.Lock()
+
+
+def _install_stream_proxy(name):
+    # Only done once (or again when something else replaced the stream, e.g. pytest's capture)
+    with _STREAM_PROXY_LOCK:
+        stream = getattr(sys, name)
+        if not isinstance(stream, _ThreadMutableStream):
+            setattr(sys, name, _ThreadMutableStream(stream, name))
+
+
 @contextmanager
 def mute(mute_stdout=True, mute_stderr=True):
-    streams = []
-    if mute_stdout:
-        streams.append(sys.stdout)
-    if mute_stderr:
-        streams.append(sys.stderr)
-    with redirect_streams(source_streams=streams, target_streams=StringIO()):
+    '''Drop what the current thread writes to stdout and/or stderr, the output of other threads is not affected.'''
+    names = [name for name, is_muted in [('stdout', mute_stdout), ('stderr', mute_stderr)] if is_muted]
+    for name in names:
+        if not isinstance(getattr(sys, name), _ThreadMutableStream):
+            _install_stream_proxy(name)
+        setattr(_MUTED_THREADS, name, getattr(_MUTED_THREADS, name, 0) + 1)
+    try:
         yield
+    finally:
+        for name in names:
+            setattr(_MUTED_THREADS, name, getattr(_MUTED_THREADS, name) - 1)
 
 
 def read_file(filepath):
@@ -72,6 +108,50 @@ def read_file(filepath):
     raise last_exception
 
 
+def detect_encoding(filepath, block_size=2 ** 20):
+    '''Encoding of a file among utf8 and latin-1, as in `read_file`, checked by blocks of `block_size` bytes.'''
+    # The whole file is checked, a latin-1 character can appear anywhere and the text is decoded strictly afterwards
+    decoder = codecs.getincrementaldecoder('utf8')()
+    try:
+        with Path(filepath).open('rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                decoder.decode(block, final=False)  # Blocks can end mid-character
+        decoder.decode(b'', final=True)
+        return 'utf8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def yield_text_chunks(filepath, max_chunk_chars=10 ** 5, encoding=None):
+    '''Read a text file incrementally and yield (char_offset, chunk) pairs of at most ~`max_chunk_chars` characters.
+
+    Chunks are cut at paragraph boundaries when possible, then at line, sentence or word boundaries.
+    '''
+    if encoding is None:
+        encoding = detect_encoding(filepath)
+    offset = 0
+    buffer = ''
+    with Path(filepath).open('rt', encoding=encoding, newline='') as f:
+        while True:
+            data = f.read(max_chunk_chars)
+            buffer += data
+            while len(buffer) >= max_chunk_chars or (data == '' and buffer != ''):
+                cut_index = len(buffer) if data == '' else None
+                for separator in ['\n\n', '\n', '. ', ' ']:
+                    if cut_index is not None:
+                        break
+                    separator_index = buffer.rfind(separator, 0, max_chunk_chars)
+                    if separator_index > 0:
+                        cut_index = separator_index + len(separator)
+                if cut_index is None:
+                    cut_index = max_chunk_chars
+                chunk, buffer = buffer[:cut_index], buffer[cut_index:]
+                yield offset, chunk
+                offset += len(chunk)
+            if data == '':
+                return
+
+
 def yield_lines(filepath, gzipped=False, n_lines=None):
     filepath = Path(filepath)
     open_function = open
@@ -84,38 +164,67 @@ def yield_lines(filepath, gzipped=False, n_lines=None):
             yield l.rstrip('\n')
 
 
+def yield_lines_from_url(url, gzipped=None, n_lines=None, encoding='utf8'):
+    '''Stream the lines of a remote (or file://) text file, decompressing gzip on the fly.
+
+    The connection is closed as soon as the generator is exhausted or closed, so reading only the first lines of a
+    large file does not download the rest of it.
+    '''
+    # Inline lazy import because importing urllib.request is slow
+    from urllib.request import urlopen
+
+    if gzipped is None:
+        gzipped = url.split('?')[0].endswith('.gz')
+    with urlopen(url) as response:
+        binary_stream = gzip.GzipFile(fileobj=response) if gzipped else response
+        with io.TextIOWrapper(binary_stream, encoding=encoding) as f:
+            for i, l in enumerate(f):
+                if n_lines is not None and i >= n_lines:
+                    break
+                yield l.rstrip('\n')
+
+
 TEMP_DIR = None
 
 
-def get_temp_filepath(create=False):
-    temp_filepath = Path(tempfile.mkstemp()[1])
+def get_temp_filepath(create=False, dir=None):
+    file_descriptor, temp_filepath = tempfile.mkstemp(dir=dir)
+    os.close(file_descriptor)
+    temp_filepath = Path(temp_filepath)
     if not create:
         temp_filepath.unlink()
     return temp_filepath
 
 
-def reporthook(count, block_size, total_size):
-    # Download progress bar
-    global start_time
-    if count == 0:
-        start_time = time.time()
-        return
-    duration = time.time() - start_time
-    progress_size_mb = count * block_size / (1024 * 1024)
-    speed = progress_size_mb / duration
-    percent = int(count * block_size * 100 / total_size)
-    msg = f'\r... {percent}% - {int(progress_size_mb)} MB - {speed:.2f} MB/s - {int(duration)}s'
-    sys.stdout.write(msg)
+def get_reporthook():
+    '''Download progress bar, each download gets its own hook so that concurrent downloads do not share a start time.'''
+    start_time = None
+
+    def reporthook(count, block_size, total_size):
+        nonlocal start_time
+        if count == 0:
+            start_time = time.time()
+            return
+        duration = time.time() - start_time
+        progress_size_mb = count * block_size / (1024 * 1024)
+        speed = progress_size_mb / duration
+        percent = int(count * block_size * 100 / total_size)
+        msg = f'\r... {percent}% - {int(progress_size_mb)} MB - {speed:.2f} MB/s - {int(duration)}s'
+        sys.stdout.write(msg)
+
+    return reporthook
 
 
 def download(url, destination_path=None, overwrite=True):
+    from urllib.request import urlretrieve
+
     if destination_path is None:
         destination_path = get_temp_filepath()
     if not overwrite and destination_path.exists():
         return destination_path
     print('Downloading...')
     try:
-        urlretrieve(url, destination_path, reporthook)
+        urlretrieve(url, destination_path, get_reporthook())
         sys.stdout.write('\n')
     except (Exception, KeyboardInterrupt, SystemExit):
         print('Rolling back: remove partially downloaded file')
@@ -201,6 +310,8 @@ def ungzip(compressed_path, output_dir):
 
 
 def unbz2(compressed_path, output_dir):
+    from tqdm import tqdm
+
     extract_filename = os.path.basename(compressed_path).replace('.bz2', '')
     extract_path = os.path.join(output_dir, extract_filename)
     with bz2.BZ2File(compressed_path, 'rb') as compressed_file, open(extract_path, 'wb') as extract_file:
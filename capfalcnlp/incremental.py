@@ -0,0 +1,63 @@
+'''Incremental re-analysis of documents being edited.
+
+Documents are split into sentences (with the same NLTK splitter as the long sentence detector, on the whole document)
+and the detections of each sentence are cached under a hash of its content, so that after an edit only the changed
+sentences are analysed again, the others only have their `char_offset` shifted.
+Sentences spanning a line break are kept whole, so the sentence level detections match those of `get_detections` on
+the whole document.
+The sentence splitter still runs on the whole document at each call: it is much faster than the spaCy pipeline and
+the detectors, which only run on the changed sentences, but the cost of an edit still grows with the document length.
+'''
+import hashlib
+
+from capfalcnlp.caching import LRUCache
+from capfalcnlp.features import get_detections_batch
+from capfalcnlp.processing import get_sentence_spans
+
+
+def yield_segments(text):
+    '''Yield (char_offset, segment) for each sentence of the text.'''
+    for start, end in get_sentence_spans(text, language='fr'):
+        yield start, text[start:end]
+
+
+def get_segment_key(segment, detectors=None):
+    return (hashlib.sha1(segment.encode('utf8')).digest(), None if detectors is None else tuple(detectors))
+
+
+class IncrementalAnalyzer:
+    '''Run `get_detections` on a document, only re-analysing the segments that changed since previous calls.
+
+    The cache is shared by all the documents analysed with the same instance.
+    '''
+
+    def __init__(self, detectors=None, cache_size=10 ** 5):
+        self.detectors = detectors
+        self.cache = LRUCache(maxsize=cache_size)
+
+    def get_detections(self, text):
+        segments = list(yield_segments(text))
+        keys = [get_segment_key(segment, self.detectors) for _, segment in segments]
+        key_to_detections = {}
+        key_to_unseen_segment = {}
+        for key, (_, segment) in zip(keys, segments):
+            if key in key_to_detections or key in key_to_unseen_segment:
+                continue
+            detections = self.cache.get(key)
+            if detections is None:
+                key_to_unseen_segment[key] = segment
+            else:
+                key_to_detections[key] = detections
+        # The changed sentences go through the pipeline together instead of one call each
+        unseen_detections = get_detections_batch(list(key_to_unseen_segment.values()), detectors=self.detectors)
+        for key, detections in zip(key_to_unseen_segment, unseen_detections):
+            self.cache.put(key, detections)
+            key_to_detections[key] = detections
+        detections = []
+        for key, (offset, _) in zip(keys, segments):
+            for detection in key_to_detections[key]:
+                detections.append({**detection, 'char_offset': detection['char_offset'] + offset})
+        return detections
+
+    def get_stats(self):
+        return self.cache.get_stats()
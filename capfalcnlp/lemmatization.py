@@ -0,0 +1,41 @@
+'''Lefff lemmatization modes of the French pipeline (see `processing.configure_lemmatization`).
+
+The detectors read spaCy's own lemmas (`token.lemma_`), the Lefff lemmas (`token._.lefff_lemma`) are only computed for
+the code that reads them:
+    full: MElt POS tagger then the Lefff lemmatizer on the MElt tags, as provided by spacy-lefff
+    fast: MElt, the slowest component of the pipeline, is not added and Lefff uses the POS of spaCy's tagger
+    none: the Lefff components are not added at all, the default since no detector reads the Lefff lemmas
+'''
+from collections import Counter
+
+
+LEMMATIZATION_MODES = ['full', 'fast', 'none']
+
+
+def compare_lemmatization_modes(texts, n_examples=20):
+    '''How often the fast mode gives a different Lefff lemma than the full pipeline, on the given texts.'''
+    # Inline import because processing imports this module
+    from capfalcnlp.processing import load_spacy_model
+
+    full_spacy_model = load_spacy_model(language='fr', lemmatization_mode='full')
+    fast_spacy_model = load_spacy_model(language='fr', lemmatization_mode='fast')
+    texts = [str(text) for text in texts]
+    n_tokens = 0
+    n_different = 0
+    differences = Counter()
+    for full_doc, fast_doc in zip(full_spacy_model.pipe(texts), fast_spacy_model.pipe(texts)):
+        for full_token, fast_token in zip(full_doc, fast_doc):
+            n_tokens += 1
+            full_lemma, fast_lemma = full_token._.lefff_lemma, fast_token._.lefff_lemma
+            if fast_lemma != full_lemma:
+                n_different += 1
+                differences[(full_token.text, full_lemma, fast_lemma)] += 1
+    return {
+        'n_tokens': n_tokens,
+        'n_different': n_different,
+        'different_rate': n_different / n_tokens if n_tokens > 0 else None,
+        'examples': [
+            {'text': text, 'full_lemma': full_lemma, 'fast_lemma': fast_lemma, 'count': count}
+            for (text, full_lemma, fast_lemma), count in differences.most_common(n_examples)
+        ],
+    }
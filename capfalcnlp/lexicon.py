@@ -0,0 +1,73 @@
+'''Lexicon matching over whole texts with an Aho-Corasick automaton.'''
+from pathlib import Path
+
+from capfalcnlp.helpers import yield_lines
+
+
+class AhoCorasick:
+    '''Find all the occurrences of a set of strings in a text in a single linear pass.'''
+
+    def __init__(self, patterns):
+        self._transitions = [{}]
+        self._fail = [0]
+        self._output_lengths = [[]]  # Lengths of the patterns ending at each node
+        for pattern in set(patterns):
+            if pattern != '':
+                self._add(pattern)
+        self._build_fail_links()
+
+    def _add(self, pattern):
+        node = 0
+        for char in pattern:
+            next_node = self._transitions[node].get(char)
+            if next_node is None:
+                next_node = len(self._transitions)
+                self._transitions[node][char] = next_node
+                self._transitions.append({})
+                self._fail.append(0)
+                self._output_lengths.append([])
+            node = next_node
+        self._output_lengths[node].append(len(pattern))
+
+    def _build_fail_links(self):
+        # Breadth first traversal so that the fail links of shorter prefixes are built first
+        queue = list(self._transitions[0].values())
+        for node in queue:
+            for char, next_node in self._transitions[node].items():
+                fail = self._fail[node]
+                while fail != 0 and char not in self._transitions[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_node] = self._transitions[fail].get(char, 0)
+                self._output_lengths[next_node] = (
+                    self._output_lengths[next_node] + self._output_lengths[self._fail[next_node]]
+                )
+                queue.append(next_node)
+
+    def iter_matches(self, text):
+        '''Yield the (start, end) character spans of all the (possibly overlapping) occurrences of the patterns.'''
+        transitions = self._transitions
+        fail = self._fail
+        output_lengths = self._output_lengths
+        node = 0
+        for i, char in enumerate(text):
+            while node != 0 and char not in transitions[node]:
+                node = fail[node]
+            node = transitions[node].get(char, 0)
+            for length in output_lengths[node]:
+                yield i + 1 - length, i + 1
+
+
+def get_leftmost_longest_matches(matches):
+    '''Keep non overlapping matches, preferring the leftmost then the longest ones.'''
+    selected_matches = []
+    last_end = -1
+    for start, end in sorted(matches, key=lambda match: (match[0], -match[1])):
+        if start >= last_end:
+            selected_matches.append((start, end))
+            last_end = end
+    return selected_matches
+
+
+def load_lexicon_file(filepath):
+    '''Read a lexicon file with one entry per line, empty lines and lines starting with # are ignored.'''
+    return [line.strip() for line in yield_lines(Path(filepath)) if line.strip() != '' and not line.startswith('#')]
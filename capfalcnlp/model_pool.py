@@ -0,0 +1,165 @@
+'''Per-language models loaded on demand and evicted under a memory budget.
+
+A `ModelPool` routes each document to the pipeline of its language (given or detected from stop words), loads the
+spaCy pipelines and sentence tokenizers the first time a language is seen, and evicts the least recently used ones
+when the estimated memory of the loaded models exceeds `max_bytes`, so that one worker can serve many languages.
+The rank indexes are not part of the pool, they are memory-mapped and their pages are shared and reclaimable.
+'''
+from collections import OrderedDict, deque
+from functools import lru_cache
+import gc
+import importlib
+import os
+import re
+import threading
+import time
+
+from capfalcnlp.processing import drop_cached_spacy_docs, load_nltk_sentence_tokenizer, load_spacy_model
+
+
+LANGUAGES = ['fr', 'en', 'es', 'it', 'de']
+# Lower bounds of the model sizes, also used when the resident memory can not be measured (non Linux platforms)
+SPACY_MODEL_BYTES_ESTIMATES = {'sm': 100 * 1024 ** 2, 'md': 300 * 1024 ** 2, 'lg': 1000 * 1024 ** 2}
+SENTENCE_TOKENIZER_BYTES_ESTIMATE = 5 * 1024 ** 2
+
+
+def get_rss_bytes():
+    '''Current resident memory of the process, None when /proc is not available.'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+@lru_cache()
+def get_stop_words(language):
+    # Only imports the stop word list of the language, not the model
+    return importlib.import_module(f'spacy.lang.{language}.stop_words').STOP_WORDS
+
+
+def detect_language(text, languages=LANGUAGES, default_language='fr', n_chars=2000):
+    '''Language of the text whose stop words are the most frequent among its first `n_chars` characters.'''
+    words = re.findall(r'\w+', text[:n_chars].lower())
+    scores = {language: sum(word in get_stop_words(language) for word in words) for language in languages}
+    best_language = max(languages, key=lambda language: scores[language])
+    return best_language if scores[best_language] > 0 else default_language
+
+
+class ModelPool:
+    '''Lazily loaded spaCy pipelines and sentence tokenizers, least recently used ones are evicted beyond `max_bytes`.
+
+    `on_event` is called with each load and eviction event (a dict), the last events are also kept in `events`.
+    '''
+
+    def __init__(self, max_bytes=2 * 1024 ** 3, languages=LANGUAGES, size='md', default_language='fr', on_event=None):
+        self.max_bytes = max_bytes
+        self.languages = list(languages)
+        self.size = size
+        self.default_language = default_language
+        self.on_event = on_event
+        self.events = deque(maxlen=1000)
+        self.n_loads = 0
+        self.n_evictions = 0
+        self._models = OrderedDict()  # (kind, language) -> model, from the least to the most recently used
+        self._sizes = {}
+        self._measured_sizes = {}  # Size of each model at its first load, reloads reuse freed memory and look smaller
+        self._lock = threading.RLock()
+
+    @property
+    def n_bytes(self):
+        return sum(self._sizes.values())
+
+    def _add_event(self, event, key, n_bytes, **kwargs):
+        kind, language = key
+        event = {'event': event, 'kind': kind, 'language': language, 'n_bytes': n_bytes, 'time': time.time(), **kwargs}
+        self.events.append(event)
+        if self.on_event is not None:
+            self.on_event(event)
+
+    def _evict(self, key):
+        self._models.pop(key)
+        n_bytes = self._sizes.pop(key)
+        kind, language = key
+        if kind == 'spacy':
+            # Cached docs keep the vocab of their pipeline (vectors, strings, lookups) alive
+            drop_cached_spacy_docs(language)
+        gc.collect()  # spaCy pipelines hold reference cycles, free their memory now
+        self.n_evictions += 1
+        self._add_event('evict', key, n_bytes)
+
+    def _get(self, key, load, estimated_bytes):
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            estimated_bytes = self._measured_sizes.get(key, estimated_bytes)
+            # Make room before loading so that the peak memory stays within the budget
+            while len(self._models) > 0 and self.n_bytes + estimated_bytes > self.max_bytes:
+                self._evict(next(iter(self._models)))
+            rss_before = get_rss_bytes()
+            start_time = time.perf_counter()
+            model = load()
+            duration = time.perf_counter() - start_time
+            if key not in self._measured_sizes:
+                # The resident memory also misses the pages that are not touched yet, hence the lower bound
+                rss_delta = get_rss_bytes() - rss_before if rss_before is not None else 0
+                self._measured_sizes[key] = max(rss_delta, estimated_bytes)
+            n_bytes = self._measured_sizes[key]
+            self._models[key] = model
+            self._sizes[key] = n_bytes
+            self.n_loads += 1
+            self._add_event('load', key, n_bytes, duration_s=duration)
+            # The estimate can be below the actual size, evict other models if needed but keep the one just loaded
+            while len(self._models) > 1 and self.n_bytes > self.max_bytes:
+                self._evict(next(iter(self._models)))
+            return model
+
+    def get_language(self, text, language=None):
+        if language is not None:
+            assert language in self.languages, f'Language {language} is not served by this pool'
+            return language
+        return detect_language(text, self.languages, default_language=self.default_language)
+
+    def get_spacy_model(self, language):
+        return self._get(
+            ('spacy', language),
+            lambda: load_spacy_model(language, self.size),
+            SPACY_MODEL_BYTES_ESTIMATES.get(self.size, SPACY_MODEL_BYTES_ESTIMATES['md']),
+        )
+
+    def get_sentence_tokenizer(self, language):
+        return self._get(
+            ('sentence_tokenizer', language),
+            lambda: load_nltk_sentence_tokenizer(language),
+            SENTENCE_TOKENIZER_BYTES_ESTIMATE,
+        )
+
+    def process(self, text, language=None, disable=()):
+        '''Return (language, doc) where doc is the text processed by the pipeline of its (detected) language.'''
+        language = self.get_language(text, language)
+        return language, self.get_spacy_model(language)(str(text), disable=list(disable))
+
+    def split_in_sentences(self, text, language=None):
+        language = self.get_language(text, language)
+        return self.get_sentence_tokenizer(language).tokenize(' '.join(text.split('\n')))
+
+    def clear(self):
+        with self._lock:
+            while len(self._models) > 0:
+                self._evict(next(iter(self._models)))
+            self._measured_sizes.clear()  # Cleared when the pipelines change (e.g. lemmatization mode)
+
+    def get_loaded(self):
+        with self._lock:
+            return list(self._models)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'loaded': [f'{kind}.{language}' for kind, language in self._models],
+                'n_bytes': self.n_bytes,
+                'max_bytes': self.max_bytes,
+                'loads': self.n_loads,
+                'evictions': self.n_evictions,
+            }
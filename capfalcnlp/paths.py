@@ -8,3 +8,4 @@ MODELS_DIR = RESOURCES_DIR / "models"
 for dir_path in [MODELS_DIR]:
     dir_path.mkdir(exist_ok=True, parents=True)
 FASTTEXT_EMBEDDINGS_DIR = Path(MODELS_DIR) / "fasttext-vectors/"
+SNAPSHOT_DIR = Path(MODELS_DIR) / "snapshot"
@@ -1,12 +1,26 @@
 from functools import lru_cache
+import pickle
 import re
 import string
+import sys
+import threading
 
+from capfalcnlp.caching import LRUCache
 from capfalcnlp.helpers import mute
+from capfalcnlp.paths import SNAPSHOT_DIR
+from capfalcnlp.profiling import is_profiling, profile_stage
 
 
-@lru_cache()
-def get_spacy_model(language='fr', size='md', **kwargs):
+LEFFF_PIPES = ['pos', 'lefff']
+LEMMATIZATION_MODE = 'none'  # No detector reads the Lefff lemmas, see capfalcnlp.lemmatization
+
+
+def get_spacy_snapshot_path(language='fr', size='md'):
+    return SNAPSHOT_DIR / f'spacy_{language}_{size}'
+
+
+def load_spacy_model(language='fr', size='md', lemmatization_mode=None, **kwargs):
+    '''Load a new spaCy pipeline, use `get_spacy_model` to get the shared one.'''
     # Inline lazy import because importing spacy is slow
     import spacy
 
@@ -20,42 +34,314 @@ def get_spacy_model(language='fr', size='md', **kwargs):
         'it': f'it_core_news_{size}',
         'de': f'de_core_news_{size}',
     }[language]
-    spacy_model = spacy.load(model_name)  # python -m spacy download en_core_web_sm
-    if language == 'fr':
-        spacy_model = add_leff(spacy_model)
+    with profile_stage('spacy.load'):
+        snapshot_path = get_spacy_snapshot_path(language, size)
+        if snapshot_path.exists():
+            # The Lefff components are not serializable, they are skipped and added back below
+            spacy_model = spacy.load(snapshot_path, disable=LEFFF_PIPES)
+        else:
+            spacy_model = spacy.load(model_name)  # python -m spacy download en_core_web_sm
+        if language == 'fr':
+            spacy_model = add_leff(spacy_model, lemmatization_mode=lemmatization_mode)
     return spacy_model
 
 
-def add_leff(spacy_model):
+_load_shared_spacy_model = lru_cache()(load_spacy_model)
+_SPACY_MODEL_LOCK = threading.Lock()
+_THREAD_LOCAL_MODELS = threading.local()
+MODEL_POOL = None  # See use_model_pool
+
+
+def use_thread_local_spacy_models():
+    '''Make `get_spacy_model` load a private pipeline for the calling thread (e.g. as a thread pool initializer).'''
+    _THREAD_LOCAL_MODELS.models = {}
 
+
+def use_model_pool(model_pool):
+    '''Load the spaCy pipelines and sentence tokenizers through a `capfalcnlp.model_pool.ModelPool` (None to stop).
+
+    The pooled models are evicted under the memory budget of the pool instead of being kept for the whole process.
+    '''
+    global MODEL_POOL
+    clear_loaded_models()
+    MODEL_POOL = model_pool
+
+
+def _is_pooled(language='fr', size='md', **kwargs):
+    return MODEL_POOL is not None and language in MODEL_POOL.languages and size == MODEL_POOL.size and not kwargs
+
+
+def get_spacy_model(language='fr', size='md', **kwargs):
+    '''Pipeline shared read-only by all the threads, or private to the thread after `use_thread_local_spacy_models`.'''
+    thread_models = getattr(_THREAD_LOCAL_MODELS, 'models', None)
+    if thread_models is not None:
+        key = (language, size, LEMMATIZATION_MODE, tuple(sorted(kwargs.items())))
+        if key not in thread_models:
+            thread_models[key] = load_spacy_model(language, size, **kwargs)
+        return thread_models[key]
+    if _is_pooled(language, size, **kwargs):
+        return MODEL_POOL.get_spacy_model(language)
+    # The lock makes concurrent first calls wait for a single load instead of each loading its own copy
+    with _SPACY_MODEL_LOCK:
+        return _load_shared_spacy_model(language, size, **kwargs)
+
+
+def silence_lefff_logs():
+    # MElt and Lefff log each processed doc, done once at load time instead of muting every call
+    import logging
+
+    logging.getLogger('spacy_lefff').setLevel(logging.WARNING)
+
+
+def add_leff(spacy_model, lemmatization_mode=None):
+    if lemmatization_mode is None:
+        lemmatization_mode = LEMMATIZATION_MODE
+    if lemmatization_mode == 'none':
+        return spacy_model
     with mute():
         # TODO: Still does not mute everything
         from spacy_lefff import LefffLemmatizer, POSTagger
 
-        spacy_model.add_pipe(POSTagger(), name='pos', after='parser')
-        spacy_model.add_pipe(LefffLemmatizer(after_melt=True), name='lefff', after='pos')
+        silence_lefff_logs()
+        if lemmatization_mode == 'full':
+            spacy_model.add_pipe(POSTagger(), name='pos', after='parser')
+            spacy_model.add_pipe(LefffLemmatizer(after_melt=True), name='lefff', after='pos')
+        elif lemmatization_mode == 'fast':
+            # Lefff uses the POS of spaCy's tagger instead of MElt, the slowest component of the pipeline
+            spacy_model.add_pipe(LefffLemmatizer(), name='lefff', after='tagger')
+        else:
+            raise NotImplementedError(f'Lemmatization mode {lemmatization_mode} does not exist.')
     return spacy_model
 
 
-@lru_cache(maxsize=10 ** 6)
-def spacy_process(text, **kwargs):
-    with mute():
-        return get_spacy_model(**kwargs)(str(text))
+def configure_lemmatization(mode='none'):
+    '''Choose how the French pipeline computes Lefff lemmas ('full', 'fast' or 'none'), models reload on next use.'''
+    global LEMMATIZATION_MODE
+    from capfalcnlp.lemmatization import LEMMATIZATION_MODES
+
+    assert mode in LEMMATIZATION_MODES, f'Lemmatization mode {mode} does not exist.'
+    LEMMATIZATION_MODE = mode
+    clear_loaded_models()  # Also clears the docs annotated by the previous pipeline
+
+
+def save_spacy_model_snapshot(language='fr', size='md'):
+    '''Save the assembled pipeline to a local directory that `get_spacy_model` loads instead of the model package.'''
+    snapshot_path = get_spacy_snapshot_path(language, size)
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    spacy_model = get_spacy_model(language, size)
+    spacy_model.to_disk(snapshot_path, exclude=[pipe for pipe in LEFFF_PIPES if pipe in spacy_model.pipe_names])
+    return snapshot_path
 
 
-@lru_cache()
-def get_nltk_sentence_tokenizer(language='fr'):
+# Pipeline components needed to compute each token attribute, the text only needs the tokenizer
+REQUIREMENT_TO_PIPES = {
+    'text': [],
+    'lemma': ['tagger'],  # token.lemma_ is set by spaCy's lemmatizer from the tagger's POS
+    'pos': ['tagger'],
+    # token._.lefff_lemma (MElt POS tags in the full mode), only set after configure_lemmatization('full' or 'fast')
+    'lefff_lemma': ['tagger', 'pos', 'lefff'],
+    'entities': ['ner'],
+}
+
+
+def get_disabled_pipes(requirements, **kwargs):
+    needed_pipes = {pipe for requirement in requirements for pipe in REQUIREMENT_TO_PIPES[requirement]}
+    return tuple(pipe for pipe in get_spacy_model(**kwargs).pipe_names if pipe not in needed_pipes)
+
+
+class CompactToken:
+    '''Token attributes used by the detectors, without a reference to the spaCy Doc.'''
+
+    __slots__ = ['text', 'idx', 'lemma_', 'pos_', 'lower', 'is_punct', 'is_stop', 'is_space', 'ent_type_']
+
+    def __init__(self, text, idx, lemma_, pos_, lower, is_punct, is_stop, is_space, ent_type_):
+        self.text = text
+        self.idx = idx
+        self.lemma_ = lemma_
+        self.pos_ = pos_
+        self.lower = lower  # Hash of the lowercased text, as in spaCy
+        self.is_punct = is_punct
+        self.is_stop = is_stop
+        self.is_space = is_space
+        self.ent_type_ = ent_type_
+
+    @classmethod
+    def from_spacy_token(cls, token):
+        return cls(
+            token.text,
+            token.idx,
+            token.lemma_,
+            token.pos_,
+            token.lower,
+            token.is_punct,
+            token.is_stop,
+            token.is_space,
+            token.ent_type_,
+        )
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return self.text
+
+    def __len__(self):
+        return len(self.text)
+
+
+class CompactDoc:
+    '''Lightweight stand-in for a spaCy Doc, storing only the compact token attributes and the sentence boundaries.'''
+
+    def __init__(self, text, tokens, sentence_spans=None, is_nered=False):
+        self.text = text
+        self.tokens = tokens
+        self.sentence_spans = sentence_spans
+        self.is_nered = is_nered
+
+    @classmethod
+    def from_spacy_doc(cls, doc):
+        sentence_spans = None
+        if doc.is_sentenced:
+            sentence_spans = [(sentence.start_char, sentence.end_char) for sentence in doc.sents]
+        tokens = [CompactToken.from_spacy_token(token) for token in doc]
+        return cls(doc.text, tokens, sentence_spans, is_nered=doc.is_nered)
+
+    @property
+    def sents(self):
+        if self.sentence_spans is None:
+            raise ValueError('Sentence boundaries are not set, the parser was disabled.')
+        return [self.text[start:end] for start, end in self.sentence_spans]
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def __getitem__(self, i):
+        return self.tokens[i]
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __str__(self):
+        return self.text
+
+
+# Rough estimates of the memory held by cached docs, spaCy Docs also hold the parse and the Lefff/MElt annotations
+SPACY_DOC_BYTES_PER_TOKEN = 1000
+COMPACT_DOC_BYTES_PER_TOKEN = 300
+
+
+def estimate_doc_size(doc):
+    bytes_per_token = COMPACT_DOC_BYTES_PER_TOKEN if isinstance(doc, CompactDoc) else SPACY_DOC_BYTES_PER_TOKEN
+    return sys.getsizeof(doc.text) + len(doc) * bytes_per_token
+
+
+SPACY_DOC_CACHE = LRUCache(max_bytes=256 * 1024 ** 2, sizeof=estimate_doc_size)
+COMPACT_SPACY_DOCS = False
+
+
+def configure_spacy_doc_cache(max_bytes=256 * 1024 ** 2, compact=False):
+    '''Replace the cache of `spacy_process`, with `compact=True` only token attributes are kept (see `CompactDoc`).'''
+    global SPACY_DOC_CACHE, COMPACT_SPACY_DOCS
+    SPACY_DOC_CACHE = LRUCache(max_bytes=max_bytes, sizeof=estimate_doc_size)
+    COMPACT_SPACY_DOCS = compact
+
+
+def get_spacy_doc_cache_stats():
+    return SPACY_DOC_CACHE.get_stats()
+
+
+def drop_cached_spacy_docs(language):
+    '''Remove the docs of the language from the `spacy_process` cache, they hold the vocab of their pipeline.'''
+    for key, _ in SPACY_DOC_CACHE.items():
+        if dict(key[2]).get('language', 'fr') == language:
+            SPACY_DOC_CACHE.pop(key)
+
+
+def _run_spacy_model(spacy_model, text, disable=()):
+    if not is_profiling():
+        return spacy_model(text, disable=list(disable))
+    # Same as spacy_model(text, disable=disable), timing each component
+    with profile_stage('spacy.tokenizer'):
+        doc = spacy_model.make_doc(text)
+    for name, component in spacy_model.pipeline:
+        if name in disable:
+            continue
+        with profile_stage(f'spacy.{name}'):
+            doc = component(doc)
+    return doc
+
+
+def spacy_process(text, disable=(), **kwargs):
+    text = str(text)
+    disable = tuple(disable)
+    key = (text, disable, tuple(sorted(kwargs.items())))
+    doc = SPACY_DOC_CACHE.get(key)
+    if doc is None:
+        doc = _run_spacy_model(get_spacy_model(**kwargs), text, disable=disable)
+        if COMPACT_SPACY_DOCS:
+            doc = CompactDoc.from_spacy_doc(doc)
+        SPACY_DOC_CACHE.put(key, doc)
+    return doc
+
+
+def spacy_pipe(texts, n_process=1, batch_size=32, disable=(), **kwargs):
+    docs = get_spacy_model(**kwargs).pipe(
+        (str(text) for text in texts), n_process=n_process, batch_size=batch_size, disable=list(disable)
+    )
+    while True:
+        with profile_stage('spacy.pipe'):
+            doc = next(docs, None)
+        if doc is None:
+            return
+        yield doc
+
+
+def get_punkt_snapshot_path(language='fr'):
+    return SNAPSHOT_DIR / f'punkt_{language}.pickle'
+
+
+def load_nltk_sentence_tokenizer(language='fr'):
+    '''Load a new sentence tokenizer, use `get_nltk_sentence_tokenizer` to get the shared one.'''
+    snapshot_path = get_punkt_snapshot_path(language)
+    if snapshot_path.exists():
+        with profile_stage('nltk.load'), snapshot_path.open('rb') as f:
+            return pickle.load(f)
     # Inline lazy import because importing nltk is slow
     import nltk
-    nltk.download('punkt')
-    language = {
-        'en': 'english',
-        'fr': 'french',
-        'es': 'spanish',
-        'it': 'italian',
-        'de': 'german',
-    }[language]
-    return nltk.data.load(f'tokenizers/punkt/{language}.pickle')
+
+    punkt_path = 'tokenizers/punkt/{}.pickle'.format(
+        {
+            'en': 'english',
+            'fr': 'french',
+            'es': 'spanish',
+            'it': 'italian',
+            'de': 'german',
+        }[language]
+    )
+    with profile_stage('nltk.load'):
+        try:
+            return nltk.data.load(punkt_path)
+        except LookupError:
+            # Only hit the network when punkt is not installed yet
+            nltk.download('punkt')
+            return nltk.data.load(punkt_path)
+
+
+_load_shared_nltk_sentence_tokenizer = lru_cache()(load_nltk_sentence_tokenizer)
+
+
+def get_nltk_sentence_tokenizer(language='fr'):
+    if _is_pooled(language):
+        return MODEL_POOL.get_sentence_tokenizer(language)
+    return _load_shared_nltk_sentence_tokenizer(language)
+
+
+def save_nltk_sentence_tokenizer_snapshot(language='fr'):
+    snapshot_path = get_punkt_snapshot_path(language)
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    with snapshot_path.open('wb') as f:
+        pickle.dump(get_nltk_sentence_tokenizer(language), f)
+    return snapshot_path
 
 
 def _split_in_sentences_spacy(text, **kwargs):
@@ -69,6 +355,14 @@ def _split_in_sentences_nltk(text, **kwargs):
     return get_nltk_sentence_tokenizer(**kwargs).tokenize(text)
 
 
+def get_sentence_spans(text, **kwargs):
+    '''Character spans of the sentences of the text, split with NLTK.'''
+    text = text.replace('\n', ' ')  # Same length so the spans are also valid in the original text
+    sentence_tokenizer = get_nltk_sentence_tokenizer(**kwargs)
+    with profile_stage('nltk.sentence_split'):
+        return list(sentence_tokenizer.span_tokenize(text))
+
+
 def split_in_sentences(text, backend='nltk', **kwargs):
     if backend == 'nltk':
         return _split_in_sentences_nltk(text, **kwargs)
@@ -79,11 +373,29 @@ def split_in_sentences(text, backend='nltk', **kwargs):
 
 
 @lru_cache()
-def get_spacy_tokenizer(**kwargs):
+def _create_shared_spacy_tokenizer(**kwargs):
     spacy_model = get_spacy_model(**kwargs)
     return spacy_model.Defaults.create_tokenizer(spacy_model)
 
 
+def get_spacy_tokenizer(**kwargs):
+    if _is_pooled(**kwargs):
+        # Not cached, a tokenizer would keep the vocab of its pipeline alive after the pool evicted it
+        return get_spacy_model(**kwargs).tokenizer
+    return _create_shared_spacy_tokenizer(**kwargs)
+
+
+def clear_loaded_models():
+    '''Drop the loaded spaCy pipelines, tokenizers and sentence tokenizers, they are loaded again on next use.'''
+    with _SPACY_MODEL_LOCK:
+        _load_shared_spacy_model.cache_clear()
+    _create_shared_spacy_tokenizer.cache_clear()
+    _load_shared_nltk_sentence_tokenizer.cache_clear()
+    if MODEL_POOL is not None:
+        MODEL_POOL.clear()
+    SPACY_DOC_CACHE.clear()
+
+
 def is_spacy_content_token(token):
     return not token.is_stop and not token.is_punct and token.ent_type_ == ''  # Not named entity
 
@@ -92,8 +404,84 @@ def get_spacy_content_tokens(text, **kwargs):
     return [token for token in get_spacy_tokenizer(**kwargs)(text) if is_spacy_content_token(token)]
 
 
-def count_content_tokens(text, **kwargs):
-    return len(get_spacy_content_tokens(text, **kwargs))
+@lru_cache()
+def get_stop_word_hashes(**kwargs):
+    '''Hashes of the lowercased stop words in the spaCy string store, to be compared with `token.lower`.'''
+    spacy_model = get_spacy_model(**kwargs)
+    return frozenset(spacy_model.vocab.strings.add(word.lower()) for word in spacy_model.Defaults.stop_words)
+
+
+def is_likely_entity(token, is_sentence_start):
+    # Without NER, capitalized words that do not start the sentence are most likely proper nouns or acronyms
+    return not is_sentence_start and token.text[:1].isupper()
+
+
+def count_content_tokens_in_spans(doc, spans, entity_heuristic=True, **kwargs):
+    '''Count the content tokens of an already processed doc in each of the sorted, non overlapping character spans.
+
+    Content tokens are neither stop words, punctuation nor named entities. When the NER did not run on the doc and
+    `entity_heuristic` is True, capitalized tokens that do not start their span are considered named entities.
+    '''
+    stop_word_hashes = get_stop_word_hashes(**kwargs)
+    use_entity_heuristic = entity_heuristic and not getattr(doc, 'is_nered', False)
+    counts = [0] * len(spans)
+    span_index = 0
+    is_sentence_start = True
+    for token in doc:
+        while span_index < len(spans) and token.idx >= spans[span_index][1]:
+            span_index += 1
+            is_sentence_start = True
+        if span_index == len(spans):
+            break
+        if token.idx < spans[span_index][0] or token.is_space or token.is_punct:
+            continue  # Opening quotes or dashes do not start the sentence
+        is_entity = is_likely_entity(token, is_sentence_start) if use_entity_heuristic else token.ent_type_ != ''
+        if token.lower not in stop_word_hashes and not is_entity:
+            counts[span_index] += 1
+        is_sentence_start = False
+    return counts
+
+
+def count_content_tokens_batch(sentences, batch_size=1000, entity_heuristic=True, **kwargs):
+    '''Number of content tokens of each sentence, the tokenizer runs once per batch of sentences.
+
+    The keyword arguments select the spaCy model (e.g. `language`).
+    '''
+    tokenizer = get_spacy_tokenizer(**kwargs)
+    counts = []
+    for i in range(0, len(sentences), batch_size):
+        batch = [str(sentence) for sentence in sentences[i : i + batch_size]]
+        # The tokenizer splits on spaces first so sentences joined with a space are tokenized independently
+        spans = []
+        start = 0
+        for sentence in batch:
+            spans.append((start, start + len(sentence)))
+            start += len(sentence) + 1
+        doc = tokenizer(' '.join(batch))
+        counts.extend(count_content_tokens_in_spans(doc, spans, entity_heuristic=entity_heuristic, **kwargs))
+    return counts
+
+
+def count_content_tokens(text, entity_heuristic=True, **kwargs):
+    return count_content_tokens_batch([text], entity_heuristic=entity_heuristic, **kwargs)[0]
+
+
+def compare_content_token_counts(sentences, entity_heuristic=True, **kwargs):
+    '''Compare `count_content_tokens_batch` with the counts of the full pipeline, where the NER finds the entities.'''
+    fast_counts = count_content_tokens_batch(sentences, entity_heuristic=entity_heuristic, **kwargs)
+    disable = get_disabled_pipes({'entities'}, **kwargs)
+    full_counts = []
+    for sentence in sentences:
+        doc = spacy_process(sentence, disable=disable, **kwargs)
+        full_counts += count_content_tokens_in_spans(doc, [(0, len(doc.text))], entity_heuristic=False, **kwargs)
+    differences = [fast_count - full_count for fast_count, full_count in zip(fast_counts, full_counts)]
+    n_sentences = len(sentences)
+    return {
+        'n_sentences': n_sentences,
+        'n_different': sum(difference != 0 for difference in differences),
+        'mean_absolute_difference': sum(map(abs, differences)) / n_sentences if n_sentences > 0 else None,
+        'different_indexes': [i for i, difference in enumerate(differences) if difference != 0],
+    }
 
 
 def remove_multiple_whitespaces(text):
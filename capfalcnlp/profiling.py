@@ -0,0 +1,123 @@
+'''Opt-in wall time and call count instrumentation of the detection pipeline stages.
+
+Stages are recorded by every active profiler, when no profiler is active `profile_stage` returns a shared no-op
+context manager so that the overhead is negligible.
+Profilers enabled with `enable_profiling` record the stages of all the threads, profilers passed to `record` only
+record the stages of the thread that entered the context.
+'''
+from contextlib import contextmanager, nullcontext
+import threading
+import time
+
+
+_ACTIVE_PROFILERS = []  # Process wide
+_THREAD_PROFILERS = threading.local()
+_NULL_CONTEXT = nullcontext()
+
+
+class Profiler:
+    def __init__(self):
+        self.stage_stats = {}  # name -> [n_calls, total_duration]
+        self._lock = threading.Lock()
+
+    def add(self, name, duration):
+        with self._lock:
+            stats = self.stage_stats.setdefault(name, [0, 0.0])
+            stats[0] += 1
+            stats[1] += duration
+
+    def reset(self):
+        with self._lock:
+            self.stage_stats = {}
+
+    def get_stage_stats(self):
+        with self._lock:
+            return {name: tuple(stats) for name, stats in self.stage_stats.items()}
+
+    def get_report(self):
+        return {
+            name: {'n_calls': n_calls, 'total_s': total_duration, 'mean_s': total_duration / n_calls}
+            for name, (n_calls, total_duration) in sorted(self.get_stage_stats().items(), key=lambda item: -item[1][1])
+        }
+
+
+def _get_thread_profilers():
+    return getattr(_THREAD_PROFILERS, 'profilers', ())
+
+
+def is_profiling():
+    return len(_ACTIVE_PROFILERS) > 0 or len(_get_thread_profilers()) > 0
+
+
+class _Stage:
+    __slots__ = ['name', 'start_time']
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start_time
+        for profiler in _ACTIVE_PROFILERS:
+            profiler.add(self.name, duration)
+        for profiler in _get_thread_profilers():
+            profiler.add(self.name, duration)
+
+
+def profile_stage(name):
+    if not _ACTIVE_PROFILERS and not _get_thread_profilers():
+        return _NULL_CONTEXT
+    return _Stage(name)
+
+
+@contextmanager
+def record(profiler=None):
+    '''Record the stages run by the current thread inside the context in `profiler` (a new one by default).'''
+    if profiler is None:
+        profiler = Profiler()
+    # Contexts are nested per thread, so they are exited in the reverse order they were entered
+    previous_profilers = _get_thread_profilers()
+    _THREAD_PROFILERS.profilers = (*previous_profilers, profiler)
+    try:
+        yield profiler
+    finally:
+        _THREAD_PROFILERS.profilers = previous_profilers
+
+
+# Process wide profiler for long-running processes
+GLOBAL_PROFILER = Profiler()
+
+
+def enable_profiling():
+    if GLOBAL_PROFILER not in _ACTIVE_PROFILERS:
+        _ACTIVE_PROFILERS.append(GLOBAL_PROFILER)
+
+
+def disable_profiling():
+    if GLOBAL_PROFILER in _ACTIVE_PROFILERS:
+        _ACTIVE_PROFILERS.remove(GLOBAL_PROFILER)
+
+
+def format_prometheus(profiler, cache_stats=None, prefix='capfalcnlp'):
+    '''Export the stage and cache counters in the Prometheus text format.'''
+    stage_stats = profiler.get_stage_stats()
+    lines = [
+        f'# TYPE {prefix}_stage_calls_total counter',
+        *[
+            f'{prefix}_stage_calls_total{{stage="{name}"}} {n_calls}'
+            for name, (n_calls, _) in stage_stats.items()
+        ],
+        f'# TYPE {prefix}_stage_seconds_total counter',
+        *[
+            f'{prefix}_stage_seconds_total{{stage="{name}"}} {total_duration}'
+            for name, (_, total_duration) in stage_stats.items()
+        ],
+    ]
+    for counter in ['hits', 'misses', 'evictions']:
+        lines.append(f'# TYPE {prefix}_cache_{counter}_total counter')
+        for cache_name, stats in (cache_stats or {}).items():
+            if stats.get(counter) is not None:
+                lines.append(f'{prefix}_cache_{counter}_total{{cache="{cache_name}"}} {stats[counter]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,242 @@
+'''Compact memory-mapped word rank index.
+
+The index is built once from the fastText vocabulary and then memory-mapped by every process, so that the pages are
+shared between workers and loading takes milliseconds instead of parsing the embeddings file.
+
+Layout (native byte order, unsigned 32 bits integers):
+    header: magic, version, n_words, n_slots, digest (32 bytes)
+    offsets: n_words + 1 byte offsets of each word in the blob, words are stored by increasing rank
+    ranks: n_words ranks of the words in the blob
+    slots: open addressing hash table of size n_slots (power of 2) mapping crc32(word) to word_index + 1 (0 = empty)
+    blob: utf8 encoded words concatenated
+The rank of a word is its line index in the vocabulary, the last one for duplicated words, as in a {word: line_index}
+dict built from the vocabulary. Since words are stored by increasing rank, the index of a large vocabulary also serves
+any smaller vocabulary size through a `RankIndexView`, which ignores the words ranked beyond its size.
+The digest is a sha256 of the words ranked below `digest_vocab_size` and their ranks, so that caches of results can
+be keyed on the content of the index, and a larger index of the same vocabulary has the same digest.
+
+Lookups probe the memory-mapped table in place. With `use_dict=True`, the index is decoded to a dict on the first
+lookup instead: lookups are several times faster but each process holds its own copy (about 13 MB and 130 ms for
+10^5 words), whose pages are not shared with the other processes even after a fork.
+'''
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+import hashlib
+import mmap
+import os
+from pathlib import Path
+import struct
+import threading
+import zlib
+
+from capfalcnlp.helpers import get_temp_filepath
+
+
+RANK_INDEX_MAGIC = b'CFRK'
+RANK_INDEX_VERSION = 3
+_HEADER_FORMAT = '4sIII32s'
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+_ITEM_SIZE = array('I').itemsize
+
+
+def _get_n_slots(n_words):
+    n_slots = 1
+    while n_slots < 2 * n_words:  # Load factor <= 0.5 keeps probe sequences short
+        n_slots *= 2
+    return n_slots
+
+
+def get_rank_digest(word_to_rank, digest_vocab_size=None):
+    '''sha256 of the (word, rank) pairs of rank below `digest_vocab_size` (all if None), given by increasing rank.'''
+    digest = hashlib.sha256()
+    for encoded_word, rank in word_to_rank.items():
+        if digest_vocab_size is not None and rank >= digest_vocab_size:
+            break
+        digest.update(b'%d\t%s\n' % (rank, encoded_word))
+    return digest.digest()
+
+
+def build_rank_index(words, index_path, digest_vocab_size=None):
+    '''Write the rank index of `words` (iterable sorted by decreasing frequency) to `index_path`.'''
+    index_path = Path(index_path)
+    word_to_rank = {}
+    for rank, word in enumerate(words):
+        encoded_word = word.encode('utf8')
+        word_to_rank.pop(encoded_word, None)  # Duplicated words keep their last rank, moved to the end of the order
+        word_to_rank[encoded_word] = rank
+    digest = get_rank_digest(word_to_rank, digest_vocab_size)
+    encoded_words = list(word_to_rank)
+    ranks = array('I', word_to_rank.values())
+    offsets = array('I', [0])
+    for encoded_word in encoded_words:
+        offsets.append(offsets[-1] + len(encoded_word))
+    n_words = len(encoded_words)
+    n_slots = _get_n_slots(n_words)
+    mask = n_slots - 1
+    slots = array('I', bytes(n_slots * _ITEM_SIZE))
+    for word_index, encoded_word in enumerate(encoded_words):
+        slot = zlib.crc32(encoded_word) & mask
+        while slots[slot] != 0:
+            slot = (slot + 1) & mask
+        slots[slot] = word_index + 1
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file then rename so that concurrent readers never see a partial index
+    tmp_path = get_temp_filepath(dir=index_path.parent)
+    with tmp_path.open('wb') as f:
+        f.write(struct.pack(_HEADER_FORMAT, RANK_INDEX_MAGIC, RANK_INDEX_VERSION, n_words, n_slots, digest))
+        offsets.tofile(f)
+        ranks.tofile(f)
+        slots.tofile(f)
+        for encoded_word in encoded_words:
+            f.write(encoded_word)
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+def get_rank_index_version(index_path):
+    '''Format version of the rank index file, None if it is not a rank index.'''
+    # Only the magic and version, whose position is the same in all the versions
+    with Path(index_path).open('rb') as f:
+        header = f.read(struct.calcsize('4sI'))
+    if len(header) < struct.calcsize('4sI'):
+        return None
+    magic, version = struct.unpack('4sI', header)
+    return version if magic == RANK_INDEX_MAGIC else None
+
+
+class RankIndex(Mapping):
+    '''Read-only {word: rank} mapping backed by a memory-mapped rank index file.'''
+
+    def __init__(self, index_path, use_dict=False):
+        self.index_path = Path(index_path)
+        with self.index_path.open('rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = struct.unpack_from('4sI', self._mmap)
+        assert magic == RANK_INDEX_MAGIC, f'{index_path} is not a rank index'
+        assert version == RANK_INDEX_VERSION, f'{index_path} has version {version}, expected {RANK_INDEX_VERSION}'
+        _, _, self.n_words, self.n_slots, digest = struct.unpack_from(_HEADER_FORMAT, self._mmap)
+        self.digest = digest.hex()
+        view = memoryview(self._mmap)
+        offsets_start = _HEADER_SIZE
+        ranks_start = offsets_start + (self.n_words + 1) * _ITEM_SIZE
+        slots_start = ranks_start + self.n_words * _ITEM_SIZE
+        self._blob_start = slots_start + self.n_slots * _ITEM_SIZE
+        self._offsets = view[offsets_start:ranks_start].cast('I')
+        self._ranks = view[ranks_start:slots_start].cast('I')
+        self._slots = view[slots_start : self._blob_start].cast('I')
+        self._mask = self.n_slots - 1
+        self._word2rank = None
+        self._use_dict = use_dict
+        self._lock = threading.Lock()
+
+    def _get_encoded_word(self, word_index):
+        start = self._blob_start + self._offsets[word_index]
+        end = self._blob_start + self._offsets[word_index + 1]
+        return self._mmap[start:end]
+
+    def _get_word2rank(self):
+        # Decoded once on the first lookup, None unless `use_dict`
+        if self._word2rank is None and self._use_dict:
+            with self._lock:
+                if self._word2rank is None:
+                    self._word2rank = dict(zip(self, self._ranks))
+                    self.get = self._word2rank.get  # Skips a Python call level on the hot path
+        return self._word2rank
+
+    def _probe(self, word, default=None):
+        encoded_word = word.encode('utf8', 'surrogatepass')
+        slot = zlib.crc32(encoded_word) & self._mask
+        while True:
+            word_index = self._slots[slot] - 1
+            if word_index < 0:
+                return default
+            if self._get_encoded_word(word_index) == encoded_word:
+                return self._ranks[word_index]
+            slot = (slot + 1) & self._mask
+
+    def get(self, word, default=None):
+        word2rank = self._get_word2rank()
+        if word2rank is not None:
+            return word2rank.get(word, default)
+        return self._probe(word, default)
+
+    def get_many(self, words, default=None):
+        '''Ranks of all the words, each distinct word is looked up once.'''
+        word2rank = self._get_word2rank()
+        if word2rank is None:
+            word2rank = {}
+            for word in set(words):
+                rank = self._probe(word)
+                if rank is not None:
+                    word2rank[word] = rank
+        get = word2rank.get
+        return [get(word, default) for word in words]
+
+    def count_ranks_below(self, max_rank):
+        '''Number of words with a rank below `max_rank`.'''
+        return bisect_left(self._ranks, max_rank)
+
+    def __getitem__(self, word):
+        rank = self.get(word)
+        if rank is None:
+            raise KeyError(word)
+        return rank
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def __iter__(self):
+        for word_index in range(self.n_words):
+            yield self._get_encoded_word(word_index).decode('utf8')
+
+    def __len__(self):
+        return self.n_words
+
+    def view(self, vocab_size):
+        return RankIndexView(self, vocab_size)
+
+
+class RankIndexView(Mapping):
+    '''Read-only {word: rank} mapping of the words of a `RankIndex` ranked below `vocab_size`, without copy.'''
+
+    def __init__(self, rank_index, vocab_size):
+        self.rank_index = rank_index
+        self.vocab_size = vocab_size
+        self.n_words = rank_index.count_ranks_below(vocab_size)
+
+    @property
+    def index_path(self):
+        return self.rank_index.index_path
+
+    def get(self, word, default=None):
+        rank = self.rank_index.get(word)
+        if rank is None or rank >= self.vocab_size:
+            return default
+        return rank
+
+    def get_many(self, words, default=None):
+        if self.n_words == len(self.rank_index):
+            return self.rank_index.get_many(words, default)
+        vocab_size = self.vocab_size
+        return [
+            rank if rank is not None and rank < vocab_size else default for rank in self.rank_index.get_many(words)
+        ]
+
+    def __getitem__(self, word):
+        rank = self.get(word)
+        if rank is None:
+            raise KeyError(word)
+        return rank
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def __iter__(self):
+        for word_index, word in enumerate(self.rank_index):
+            if word_index >= self.n_words:
+                return
+            yield word
+
+    def __len__(self):
+        return self.n_words
@@ -0,0 +1,273 @@
+'''Long-running detection server.
+
+Models are loaded once at startup and concurrent requests are coalesced into micro-batches that are run through
+`get_detections_batch` in a pool of worker processes.
+
+    $ python -m capfalcnlp.server --port 8000
+    $ curl -X POST localhost:8000/detections -d '{"text": "Bonjour à tous."}'
+
+Endpoints:
+    POST /detections  {"text": ..., "detectors": [...] (optional)} -> {"detections": [...]}
+    GET /health       -> {"status": "ok", ...}
+    GET /metrics      -> request counts, batch sizes and latency percentiles
+
+With `--max-model-bytes`, the spaCy pipelines and sentence tokenizers of the workers are loaded through a `ModelPool`
+and evicted when they exceed the budget.
+'''
+import argparse
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+import json
+import multiprocessing
+import os
+import time
+
+from capfalcnlp import processing
+from capfalcnlp.features import get_detections_batch, load_word_detector_resources
+from capfalcnlp.model_pool import ModelPool
+from capfalcnlp.processing import get_spacy_model, get_nltk_sentence_tokenizer, use_model_pool
+
+
+def load_resources():
+    get_spacy_model(language='fr')
+    get_nltk_sentence_tokenizer(language='fr')
+    load_word_detector_resources()
+
+
+def use_model_pool_if_needed(max_model_bytes=None):
+    if max_model_bytes is not None and processing.MODEL_POOL is None:
+        use_model_pool(ModelPool(max_bytes=max_model_bytes))
+
+
+def _init_worker(start_barrier, max_model_bytes=None):
+    use_model_pool_if_needed(max_model_bytes)  # Forked workers already inherit the pool of the server process
+    load_resources()
+    # Workers are started on demand, one per task submitted while the others are busy: waiting for all of them here
+    # makes the warm-up tasks submitted by `serve` start every worker
+    start_barrier.wait()
+
+
+def _run_batch(texts, detectors=None):
+    return list(get_detections_batch(texts, batch_size=len(texts), detectors=detectors))
+
+
+def get_percentile(sorted_values, percentile):
+    if len(sorted_values) == 0:
+        return None
+    return sorted_values[min(int(len(sorted_values) * percentile / 100), len(sorted_values) - 1)]
+
+
+class LatencyTracker:
+    def __init__(self, window_size=10000):
+        self.latencies = deque(maxlen=window_size)
+
+    def add(self, latency):
+        self.latencies.append(latency)
+
+    def get_report(self):
+        sorted_latencies = sorted(self.latencies)
+        return {
+            f'p{percentile}_ms': None if latency is None else round(latency * 1000, 3)
+            for percentile in [50, 90, 99]
+            for latency in [get_percentile(sorted_latencies, percentile)]
+        }
+
+
+class DetectionServer:
+    def __init__(self, n_workers=1, max_batch_size=32, max_wait_ms=2, max_model_bytes=None):
+        self.n_workers = n_workers
+        self.max_model_bytes = max_model_bytes
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = None
+        self.queue = None
+        self.start_time = None
+        self.n_requests = 0
+        self.n_errors = 0
+        self.n_batches = 0
+        self.n_batched_texts = 0
+        self.n_pending_batches = 0
+        self.latency_tracker = LatencyTracker()
+        self.batch_latency_tracker = LatencyTracker()
+
+    async def get_detections(self, text, detectors=None):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, detectors, future))
+        return await future
+
+    async def _collect_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        # Requests with different detectors can not share the same pipeline call
+        detectors_to_items = {}
+        for item in batch:
+            detectors = item[1]
+            detectors_to_items.setdefault(None if detectors is None else tuple(detectors), []).append(item)
+        for detectors, items in detectors_to_items.items():
+            start_time = time.monotonic()
+            texts = [text for text, _, _ in items]
+            try:
+                results = await loop.run_in_executor(self.executor, _run_batch, texts, detectors)
+            except Exception as e:
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batch_latency_tracker.add(time.monotonic() - start_time)
+            self.n_batches += 1
+            self.n_batched_texts += len(items)
+            for (_, _, future), detections in zip(items, results):
+                if not future.done():
+                    future.set_result(detections)
+
+    async def _batching_loop(self):
+        semaphore = asyncio.Semaphore(self.n_workers)  # At most one batch in flight per worker
+
+        async def run_batch_and_release(batch):
+            try:
+                await self._run_batch(batch)
+            finally:
+                self.n_pending_batches -= 1
+                semaphore.release()
+
+        while True:
+            await semaphore.acquire()
+            batch = await self._collect_batch()
+            self.n_pending_batches += 1
+            asyncio.ensure_future(run_batch_and_release(batch))
+
+    def get_health(self):
+        return {'status': 'ok', 'uptime_s': round(time.monotonic() - self.start_time, 3), 'n_workers': self.n_workers}
+
+    def get_metrics(self):
+        return {
+            'n_requests': self.n_requests,
+            'n_errors': self.n_errors,
+            'n_batches': self.n_batches,
+            'mean_batch_size': self.n_batched_texts / self.n_batches if self.n_batches > 0 else None,
+            'queue_size': self.queue.qsize(),
+            'n_pending_batches': self.n_pending_batches,
+            'request_latency': self.latency_tracker.get_report(),
+            'batch_latency': self.batch_latency_tracker.get_report(),
+        }
+
+    async def handle_request(self, method, path, body):
+        if method == 'GET' and path == '/health':
+            return HTTPStatus.OK, self.get_health()
+        if method == 'GET' and path == '/metrics':
+            return HTTPStatus.OK, self.get_metrics()
+        if path != '/detections':
+            return HTTPStatus.NOT_FOUND, {'error': f'Unknown path {path}'}
+        if method != 'POST':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Use POST'}
+        try:
+            request = json.loads(body)
+            text = request['text']
+        except (ValueError, KeyError, TypeError):
+            return HTTPStatus.BAD_REQUEST, {'error': 'Expected a JSON body with a "text" field'}
+        start_time = time.monotonic()
+        self.n_requests += 1
+        detections = await self.get_detections(text, detectors=request.get('detectors'))
+        self.latency_tracker.add(time.monotonic() - start_time)
+        return HTTPStatus.OK, {'detections': detections}
+
+    async def handle_connection(self, reader, writer):
+        # Minimal HTTP/1.1 with keep-alive, requests on the same connection are handled sequentially
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1').strip()
+                    if line == '':
+                        break
+                    key, value = line.split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                try:
+                    status, response = await self.handle_request(method, path.split('?')[0], body)
+                except Exception as e:
+                    self.n_errors += 1
+                    status, response = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': repr(e)}
+                response_body = json.dumps(response, ensure_ascii=False).encode('utf8')
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(
+                    (
+                        f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                        'Content-Type: application/json; charset=utf-8\r\n'
+                        f'Content-Length: {len(response_body)}\r\n'
+                        f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'
+                    ).encode('latin-1')
+                    + response_body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000, unix_socket=None):
+        print('Loading models...')
+        use_model_pool_if_needed(self.max_model_bytes)
+        load_resources()  # Loaded before forking so that the workers inherit the models and share the rank indexes
+        start_barrier = multiprocessing.Barrier(self.n_workers)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.n_workers, initializer=_init_worker, initargs=(start_barrier, self.max_model_bytes)
+        )
+        # Start all the workers before accepting connections, workers started later would load the models at request
+        # time and inherit the client sockets
+        for future in [self.executor.submit(os.getpid) for _ in range(self.n_workers)]:
+            future.result()
+        self.queue = asyncio.Queue()
+        self.start_time = time.monotonic()
+        batching_task = asyncio.ensure_future(self._batching_loop())
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+            print(f'Serving on {unix_socket}')
+        else:
+            server = await asyncio.start_server(self.handle_connection, host=host, port=port)
+            print(f'Serving on http://{host}:{port}')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batching_task.cancel()
+            self.executor.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix-socket', help='Serve on a Unix socket instead of TCP')
+    parser.add_argument('--n-workers', type=int, default=1)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=2, help='Time to wait for other requests to batch with')
+    parser.add_argument('--max-model-bytes', type=int, help='Memory budget of the loaded models of each worker')
+    args = parser.parse_args()
+    server = DetectionServer(
+        n_workers=args.n_workers,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_model_bytes=args.max_model_bytes,
+    )
+    asyncio.run(server.serve(host=args.host, port=args.port, unix_socket=args.unix_socket))
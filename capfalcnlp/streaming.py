@@ -0,0 +1,26 @@
+'''Analysis of inputs too large to be processed as a single spaCy Doc.'''
+from collections import deque
+
+from capfalcnlp.features import get_detections_batch
+from capfalcnlp.helpers import yield_text_chunks
+
+
+def yield_file_detections(filepath, max_chunk_chars=10 ** 5, n_process=1, batch_size=8, detectors=None):
+    '''Yield the detections of a text file of any size with `char_offset` relative to the start of the file.
+
+    The file is read incrementally and cut into chunks at paragraph (or line, sentence) boundaries which are analysed
+    with `get_detections_batch`, so memory stays bounded by the chunk and batch sizes.
+    '''
+    chunk_offsets = deque()  # Offsets of the chunks sent to the pipeline but not yielded yet
+
+    def yield_chunks():
+        for offset, chunk in yield_text_chunks(filepath, max_chunk_chars=max_chunk_chars):
+            chunk_offsets.append(offset)
+            yield chunk
+
+    for detections in get_detections_batch(
+        yield_chunks(), n_process=n_process, batch_size=batch_size, detectors=detectors
+    ):
+        chunk_offset = chunk_offsets.popleft()
+        for detection in detections:
+            yield {**detection, 'char_offset': detection['char_offset'] + chunk_offset}
@@ -1,15 +1,90 @@
 import argparse
+from collections import deque
+import json
+from pathlib import Path
 from pprint import pprint
+import sys
 
-from capfalcnlp.helpers import read_file
-from capfalcnlp.processing import spacy_process
-from capfalcnlp.features import get_detections
+from capfalcnlp.helpers import read_file, yield_lines
+from capfalcnlp.detections import save_npz, write_jsonl
+from capfalcnlp.features import get_detections, get_detections_batch
+from capfalcnlp.streaming import yield_file_detections
+
+
+def yield_documents(input_dir=None, input_jsonl=None):
+    '''Yield (document_id, text) pairs from a directory of .txt files or from a JSONL file with a "text" field.'''
+    if input_dir is not None:
+        for filepath in sorted(Path(input_dir).glob('*.txt')):
+            yield str(filepath), read_file(filepath)
+    if input_jsonl is not None:
+        for i, line in enumerate(yield_lines(input_jsonl)):
+            if line.strip() == '':
+                continue
+            document = json.loads(line)
+            yield document.get('id', i), document['text']
+
+
+def yield_batch_detections(documents, n_process=1, batch_size=32):
+    '''Yield (document_id, detections) pairs, detections are compact `Detections` objects.'''
+    document_ids = deque()  # Ids of the documents sent to the pipeline but not written yet
+
+    def yield_texts():
+        for document_id, text in documents:
+            document_ids.append(document_id)
+            yield text
+
+    for detections in get_detections_batch(yield_texts(), n_process=n_process, batch_size=batch_size, compact=True):
+        yield document_ids.popleft(), detections
+
+
+def write_batch_detections(documents, output_file, n_process=1, batch_size=32, columns=False):
+    write_jsonl(yield_batch_detections(documents, n_process, batch_size), output_file, columns=columns)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--input-file')
+    parser.add_argument('--input-dir', help='Directory of .txt documents to analyse in batch mode')
+    parser.add_argument('--input-jsonl', help='JSONL file with one {"id": ..., "text": ...} document per line')
+    parser.add_argument('--output-file', help='Output JSONL file for batch mode (defaults to stdout)')
+    parser.add_argument('--stream', action='store_true', help='Analyse --input-file by chunks, output JSONL')
+    parser.add_argument('--max-chunk-chars', type=int, default=10 ** 5)
+    parser.add_argument('--n-process', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument(
+        '--output-format',
+        choices=['dicts', 'columns', 'npz'],
+        default='dicts',
+        help='Batch mode output: JSONL of detection dicts, JSONL of columns or a NumPy .npz file (needs --output-file)',
+    )
     args = parser.parse_args()
-    text = read_file(args.input_file)
-    detections = get_detections(text)
-    pprint(detections)
+    if args.output_format == 'npz' and (args.input_dir is not None or args.input_jsonl is not None):
+        assert args.output_file is not None, '--output-format npz needs an --output-file'
+        documents = yield_documents(input_dir=args.input_dir, input_jsonl=args.input_jsonl)
+        documents_detections = yield_batch_detections(documents, n_process=args.n_process, batch_size=args.batch_size)
+        save_npz(args.output_file, documents_detections)
+    elif args.input_dir is not None or args.input_jsonl is not None or args.stream:
+        output_file = open(args.output_file, 'w') if args.output_file is not None else sys.stdout
+        try:
+            if args.stream:
+                detections = yield_file_detections(
+                    args.input_file, max_chunk_chars=args.max_chunk_chars, n_process=args.n_process
+                )
+                for detection in detections:
+                    output_file.write(json.dumps(detection, ensure_ascii=False) + '\n')
+            else:
+                documents = yield_documents(input_dir=args.input_dir, input_jsonl=args.input_jsonl)
+                write_batch_detections(
+                    documents,
+                    output_file,
+                    n_process=args.n_process,
+                    batch_size=args.batch_size,
+                    columns=args.output_format == 'columns',
+                )
+        finally:
+            if output_file is not sys.stdout:
+                output_file.close()
+    else:
+        text = read_file(args.input_file)
+        detections = get_detections(text)
+        pprint(detections)
@@ -0,0 +1,49 @@
+import copy
+
+import pytest
+
+from capfalcnlp import benchmark, features, processing
+
+
+def get_report(docs_per_s=100.0, p50_ms=10.0):
+    return {
+        'single': {'latency_ms': {'p50': p50_ms, 'p99': 2 * p50_ms}, 'docs_per_s': docs_per_s},
+        'batch': {'docs_per_s': 2 * docs_per_s},
+        'peak_rss_mb': 500.0,
+    }
+
+
+def test_get_regressions():
+    baseline = get_report()
+    assert benchmark.get_regressions(get_report(docs_per_s=90.0), baseline, tolerance=0.2) == {}
+    regressions = benchmark.get_regressions(get_report(docs_per_s=50.0, p50_ms=20.0), baseline, tolerance=0.2)
+    assert set(regressions) == {
+        'single.docs_per_s',
+        'batch.docs_per_s',
+        'single.latency_ms.p50',
+        'single.latency_ms.p99',
+    }
+    assert regressions['single.docs_per_s'] == {'value': 50.0, 'baseline': 100.0}
+    # Improvements and metrics missing from one of the reports are not regressions
+    assert benchmark.get_regressions(get_report(docs_per_s=200.0, p50_ms=5.0), baseline) == {}
+    assert benchmark.get_regressions({'peak_rss_mb': 1000.0}, {'single': {'docs_per_s': 1.0}}) == {}
+
+
+def test_offline_benchmark(tmp_path, monkeypatch):
+    pytest.importorskip('spacy')
+    pytest.importorskip('nltk')
+    # Restored after the test, use_offline_resources points them to tmp_path
+    monkeypatch.setattr(features, 'FASTTEXT_EMBEDDINGS_DIR', features.FASTTEXT_EMBEDDINGS_DIR)
+    monkeypatch.setattr(processing, 'SNAPSHOT_DIR', processing.SNAPSHOT_DIR)
+    monkeypatch.setattr(processing, 'LEMMATIZATION_MODE', processing.LEMMATIZATION_MODE)
+    benchmark.use_offline_resources(tmp_path)
+    report = benchmark.run_benchmark(n_documents=5, n_detector_tokens=1000)
+    assert report['n_tokens'] > 0
+    assert report['single']['docs_per_s'] > 0 and report['batch']['docs_per_s'] > 0
+    assert report['word_detectors']['n_tokens'] == 1000
+    assert benchmark.get_regressions(report, report) == {}
+    faster_baseline = copy.deepcopy(report)
+    faster_baseline['single']['docs_per_s'] *= 10
+    assert 'single.docs_per_s' in benchmark.get_regressions(report, faster_baseline)
+    processing.configure_lemmatization(processing.LEMMATIZATION_MODE)  # Reloads the models on next use
+    features.clear_rank_tables()
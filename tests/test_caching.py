@@ -0,0 +1,32 @@
+import sqlite3
+
+from capfalcnlp.caching import SQLiteCache
+
+
+def test_sqlite_cache_n_bytes(tmp_path):
+    cache = SQLiteCache(tmp_path / 'cache.sqlite', max_bytes=10 ** 6)
+    cache.put('a', ['x'] * 100)
+    cache.put('b', 'y')
+    cache.put('a', 'z')  # Replaced values are not counted twice
+    connection = sqlite3.connect(str(cache.path))
+    assert cache.get_n_bytes() == connection.execute('SELECT SUM(size) FROM cache').fetchone()[0]
+    assert cache.get('a') == 'z' and cache.get('c') is None
+    cache.max_bytes = cache.get_n_bytes() - 1
+    cache.evict()
+    assert cache.get_n_bytes() == connection.execute('SELECT SUM(size) FROM cache').fetchone()[0]
+    assert cache.evictions == 1
+    cache.clear()
+    assert cache.get_n_bytes() == 0
+
+
+def test_sqlite_cache_access_update_interval(tmp_path):
+    cache = SQLiteCache(tmp_path / 'cache.sqlite', access_update_interval=60)
+    cache.put('a', 1)
+    connection = sqlite3.connect(str(cache.path))
+    connection.execute("UPDATE cache SET last_access = 30 WHERE key = 'a'")
+    connection.commit()
+    assert cache.get('a') == 1
+    last_access = connection.execute("SELECT last_access FROM cache WHERE key = 'a'").fetchone()[0]
+    assert last_access > 30  # Stale access times are refreshed
+    assert cache.get('a') == 1
+    assert connection.execute("SELECT last_access FROM cache WHERE key = 'a'").fetchone()[0] == last_access
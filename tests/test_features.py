@@ -0,0 +1,67 @@
+import gzip
+import os
+
+import pytest
+
+from capfalcnlp import features
+from capfalcnlp.detections import Detections
+from capfalcnlp.helpers import yield_lines_from_url
+from capfalcnlp.ranks import RankIndex, build_rank_index
+
+
+def test_rank_table_replacement(tmp_path, monkeypatch):
+    monkeypatch.setattr(features, 'FASTTEXT_EMBEDDINGS_DIR', tmp_path)
+    features.clear_rank_tables()
+    words = [f'word{i}' for i in range(20)]
+    build_rank_index(words[:10], features.get_rank_index_path(vocab_size=10, language='xx'))
+    try:
+        small_view = features.get_word2rank(vocab_size=5, language='xx')
+        assert small_view.get('word4') == 4 and small_view.get('word5') is None
+        build_rank_index(words, features.get_rank_index_path(vocab_size=20, language='xx'))
+        features.get_rank_table(vocab_size=20, language='xx')  # Replaces the index of 10 words
+        view = features.get_word2rank(vocab_size=5, language='xx')
+        assert view.rank_index is features.get_rank_table(vocab_size=5, language='xx')
+        assert view.rank_index is not small_view.rank_index and len(view) == 5
+        assert features.get_word2rank(vocab_size=20, language='xx').get('word19') == 19
+    finally:
+        features.clear_rank_tables()
+
+
+def test_detections_batch_in_worker_processes(monkeypatch):
+    def get_fake_detections_from_doc(doc, detectors=None):
+        detections = Detections(doc)
+        detections.append(0, len(doc), str(os.getpid()))  # Records the process that ran the detectors
+        return detections
+
+    # Forked workers inherit the patched module
+    monkeypatch.setattr(features, 'get_disabled_pipes', lambda *args, **kwargs: ())
+    monkeypatch.setattr(features, 'get_nltk_sentence_tokenizer', lambda **kwargs: None)
+    monkeypatch.setattr(features, 'load_word_detector_resources', lambda: None)
+    monkeypatch.setattr(features, 'spacy_pipe', lambda texts, **kwargs: iter(texts))
+    monkeypatch.setattr(features, '_get_detections_from_doc', get_fake_detections_from_doc)
+    texts = [f'Texte {i}' for i in range(50)]
+    detections_batch = list(features.get_detections_batch(texts, n_process=2, batch_size=3, compact=True))
+    assert [detections.text for detections in detections_batch] == texts
+    assert [detections[0]['text'] for detections in detections_batch] == texts
+    assert str(os.getpid()) not in {detections[0]['detected_type'] for detections in detections_batch}
+
+
+def test_build_rank_index_from_streamed_embeddings(tmp_path, monkeypatch):
+    monkeypatch.setattr(features, 'FASTTEXT_EMBEDDINGS_DIR', tmp_path / 'embeddings')
+    lines = ['20000 3'] + [f'word{i} 0.{i} 0.{2 * i} 0.{3 * i}' for i in range(20000)]
+    compressed = gzip.compress('\n'.join(lines).encode('utf8'))
+    vectors_path = tmp_path / 'cc.xx.300.vec.gz'
+    vectors_path.write_bytes(compressed[: len(compressed) // 2])  # Truncated, reading it to the end fails
+    url = vectors_path.as_uri()
+    with pytest.raises(EOFError):
+        list(yield_lines_from_url(url))
+    rank_index_path = features.build_rank_index_if_needed(vocab_size=100, language='xx', url=url)
+    assert rank_index_path == features.get_rank_index_path(vocab_size=100, language='xx')
+    assert dict(RankIndex(rank_index_path)) == {f'word{i}': i for i in range(100)}
+
+
+def test_clear_rank_tables_clears_word_verdicts(tmp_path, monkeypatch):
+    monkeypatch.setattr(features, 'FASTTEXT_EMBEDDINGS_DIR', tmp_path)
+    features.WORD_VERDICT_CACHE.put(('mot', 'mot', 'fr'), ['Mot rare'])
+    features.clear_rank_tables()
+    assert len(features.WORD_VERDICT_CACHE) == 0
@@ -0,0 +1,132 @@
+import gzip
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+
+import pytest
+
+from capfalcnlp.fetching import fetch, fetch_and_extract
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    '''Serves `server.files` with range requests, cuts the first request of ranges starting in `server.cut_starts`.'''
+
+    def do_GET(self):
+        data = self.server.files.get(self.path.lstrip('/'))
+        if data is None:
+            self.send_error(404)
+            return
+        range_header = self.headers.get('Range')
+        if range_header is None:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        start, end = (int(offset) for offset in range_header.split('=')[1].split('-'))
+        self.server.requested_ranges.append((start, end + 1))
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.send_header('Content-Length', str(end + 1 - start))
+        self.end_headers()
+        if start in self.server.cut_starts:
+            self.server.cut_starts.remove(start)
+            self.wfile.write(data[start : start + (end + 1 - start) // 2])
+            self.close_connection = True
+            return
+        if end > 0:
+            time.sleep(self.server.range_delay)  # The other ranges finish after the cut one
+        self.wfile.write(data[start : end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+    server.files = {}
+    server.cut_starts = set()
+    server.requested_ranges = []
+    server.range_delay = 0
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_resumes_interrupted_ranges(server, tmp_path):
+    data = os.urandom(4 * 1024 ** 2)  # 4 ranges of 1 MB with 4 connections
+    server.files['data.bin'] = data
+    server.cut_starts = {1024 ** 2}
+    server.range_delay = 0.2
+    destination_path = tmp_path / 'data.bin'
+    with pytest.raises(IOError):
+        fetch(f'{server.url}/data.bin', destination_path, n_connections=4, verbose=False)
+    assert not destination_path.exists()
+    # The ranges that completed after the cut one are recorded as done
+    progress = json.loads((tmp_path / 'data.bin.partial.json').read_text())
+    assert sorted(progress['done'].values()) == [512 * 1024, *[1024 ** 2] * 3]
+    server.requested_ranges.clear()
+    sha256 = hashlib.sha256(data).hexdigest()
+    fetch(f'{server.url}/data.bin', destination_path, sha256=sha256, n_connections=4, verbose=False)
+    assert destination_path.read_bytes() == data
+    # Only the missing half of the cut range is downloaded again, after the size request
+    assert server.requested_ranges == [(0, 1), (1024 ** 2 + 512 * 1024, 2 * 1024 ** 2)]
+    assert not (tmp_path / 'data.bin.partial').exists() and not (tmp_path / 'data.bin.partial.json').exists()
+
+
+def test_fetch_sha256_mismatch(server, tmp_path):
+    server.files['data.bin'] = b'content'
+    with pytest.raises(ValueError, match='Checksum mismatch'):
+        fetch(f'{server.url}/data.bin', tmp_path / 'data.bin', sha256='0' * 64, verbose=False)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_fetch_and_extract_gz(server, tmp_path):
+    content = b'de 0.1 0.2\nla 0.3 0.4\n' * 1000
+    archive = gzip.compress(content)
+    server.files['vectors.vec.gz'] = archive
+    url = f'{server.url}/vectors.vec.gz'
+    with pytest.raises(ValueError, match='Checksum mismatch'):
+        fetch_and_extract(url, tmp_path / 'vectors.vec', sha256='0' * 64, mirror_dirs=[], verbose=False)
+    assert not (tmp_path / 'vectors.vec').exists() and not (tmp_path / 'vectors.vec.partial').exists()
+    sha256 = hashlib.sha256(archive).hexdigest()
+    fetch_and_extract(url, tmp_path / 'vectors.vec', sha256=sha256, mirror_dirs=[], verbose=False)
+    assert (tmp_path / 'vectors.vec').read_bytes() == content
+
+
+def test_fetch_and_extract_tar(server, tmp_path):
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+        for name, content in [('model/config.json', b'{}'), ('model/weights.bin', b'\0' * 1000)]:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    server.files['model.tar.gz'] = archive.getvalue()
+    cache_dir = tmp_path / 'cache'
+    destination_path = fetch_and_extract(
+        f'{server.url}/model.tar.gz', tmp_path / 'model', mirror_dirs=[], cache_dir=cache_dir, verbose=False
+    )
+    assert (destination_path / 'model' / 'config.json').read_bytes() == b'{}'
+    assert (destination_path / 'model' / 'weights.bin').stat().st_size == 1000
+    assert (cache_dir / 'model.tar.gz').read_bytes() == archive.getvalue()  # Kept for later fetches
+
+
+def test_fetch_from_mirror(tmp_path):
+    mirror_dir = tmp_path / 'mirror'
+    mirror_dir.mkdir()
+    (mirror_dir / 'vectors.vec.gz').write_bytes(gzip.compress(b'de 0.1\n'))
+    # Nothing listens on this port, the mirror is used before the network
+    url = 'http://127.0.0.1:9/fasttext/vectors.vec.gz'
+    fetch_and_extract(url, tmp_path / 'vectors.vec', mirror_dirs=[mirror_dir], verbose=False)
+    assert (tmp_path / 'vectors.vec').read_bytes() == b'de 0.1\n'
+    fetch(url, tmp_path / 'copy' / 'vectors.vec.gz', mirror_dirs=[mirror_dir], verbose=False)
+    assert (tmp_path / 'copy' / 'vectors.vec.gz').read_bytes() == (mirror_dir / 'vectors.vec.gz').read_bytes()
@@ -0,0 +1,30 @@
+from capfalcnlp.helpers import detect_encoding, read_file, yield_text_chunks
+
+
+def read_chunks(filepath, **kwargs):
+    return ''.join(chunk for _, chunk in yield_text_chunks(filepath, **kwargs))
+
+
+def test_yield_text_chunks_latin1(tmp_path):
+    filepath = tmp_path / 'short.txt'
+    filepath.write_bytes(b'Au caf\xe9')
+    assert detect_encoding(filepath) == 'latin-1'
+    assert read_chunks(filepath) == read_file(filepath) == 'Au café'
+
+
+def test_yield_text_chunks_latin1_after_first_block(tmp_path):
+    filepath = tmp_path / 'long.txt'
+    filepath.write_bytes(b'Bonjour.\n' * (12 * 10 ** 4) + b'Au caf\xe9')
+    assert detect_encoding(filepath) == 'latin-1'
+    assert read_chunks(filepath, max_chunk_chars=10 ** 4) == read_file(filepath)
+
+
+def test_yield_text_chunks_utf8(tmp_path):
+    filepath = tmp_path / 'utf8.txt'
+    text = 'Première ligne.\n\nDeuxième ligne, très longue. ' * 1000
+    filepath.write_text(text, encoding='utf8')
+    # Blocks cutting multi-byte characters in the middle
+    assert detect_encoding(filepath, block_size=7) == 'utf8'
+    chunks = list(yield_text_chunks(filepath, max_chunk_chars=1000))
+    assert ''.join(chunk for _, chunk in chunks) == text
+    assert all(text[offset : offset + len(chunk)] == chunk for offset, chunk in chunks)
@@ -0,0 +1,37 @@
+from capfalcnlp import processing
+from capfalcnlp.model_pool import ModelPool
+
+
+def test_model_pool_eviction():
+    pool = ModelPool(max_bytes=250)
+    for language in ['fr', 'en', 'fr', 'es']:
+        # Small models add no measurable resident memory, they are sized by their lower bound
+        assert pool._get(('spacy', language), lambda: language, 100) == language
+    assert pool.get_loaded() == [('spacy', 'fr'), ('spacy', 'es')]
+    assert pool.get_stats()['n_bytes'] == 200
+    assert pool.n_loads == 3 and pool.n_evictions == 1
+    pool.clear()
+    assert pool.get_loaded() == [] and pool.n_bytes == 0
+
+
+def test_use_model_pool(monkeypatch):
+    pool = ModelPool()
+    monkeypatch.setattr(pool, 'get_spacy_model', lambda language: f'pooled {language}')
+    monkeypatch.setattr(pool, 'get_sentence_tokenizer', lambda language: f'pooled punkt {language}')
+    processing.use_model_pool(pool)
+    try:
+        assert processing.get_spacy_model(language='en') == 'pooled en'
+        assert processing.get_nltk_sentence_tokenizer(language='de') == 'pooled punkt de'
+    finally:
+        processing.use_model_pool(None)
+    assert processing.MODEL_POOL is None
+
+
+def test_model_pool_eviction_drops_cached_docs(monkeypatch):
+    monkeypatch.setattr(processing, 'SPACY_DOC_CACHE', processing.LRUCache())
+    for text, kwargs in [('a', {}), ('b', {'language': 'fr'}), ('c', {'language': 'en'})]:
+        processing.SPACY_DOC_CACHE.put((text, (), tuple(sorted(kwargs.items()))), f'doc {text}')
+    pool = ModelPool(max_bytes=100)
+    pool._get(('spacy', 'fr'), lambda: 'fr', 100)
+    pool._get(('spacy', 'en'), lambda: 'en', 100)  # Evicts the French pipeline
+    assert [key[0] for key, _ in processing.SPACY_DOC_CACHE.items()] == ['c']
@@ -0,0 +1,25 @@
+import pytest
+
+from capfalcnlp.ranks import RankIndex, build_rank_index
+
+
+@pytest.mark.parametrize('use_dict', [False, True])
+def test_rank_index(tmp_path, use_dict):
+    words = ['de', 'la', 'le', 'café', 'la', 'été', '']
+    rank_index = RankIndex(build_rank_index(words, tmp_path / 'index.ranks'), use_dict=use_dict)
+    word2rank = {word: rank for rank, word in enumerate(words)}  # Duplicated words keep their last rank
+    assert dict(rank_index) == word2rank
+    assert rank_index.get_many(['la', 'inconnu', 'café', 'la'], default=-1) == [4, -1, 3, 4]
+    view = rank_index.view(4)
+    assert dict(view) == {'de': 0, 'le': 2, 'café': 3}
+    assert view.get_many(['la', 'de']) == [None, 0]
+
+
+def test_rank_index_digest(tmp_path):
+    def get_digest(words, name):
+        return RankIndex(build_rank_index(words, tmp_path / name, digest_vocab_size=3)).digest
+
+    words = ['de', 'la', 'le', 'café', 'été']
+    # Only the words ranked below digest_vocab_size are part of the digest
+    assert get_digest(words, 'a.ranks') == get_digest(words[:3], 'b.ranks') == get_digest(words + ['x'], 'c.ranks')
+    assert get_digest(['de', 'le', 'la'], 'd.ranks') != get_digest(words, 'a.ranks')